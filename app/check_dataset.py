@@ -2,13 +2,18 @@
 
 from loguru import logger
 import pandas as pd
+from typing import Callable, Dict, Tuple
 
 import app.checks as checks
+import app.vector_checks as vector_checks
+import app.forecast_stage as forecast_stage
 from .qc_config import QCConfig
 from .data.data_source import DataSource
 from .log.result_log import ResultLog
-from .modeling.forecast_io import load_forecast_hd5
-from .modeling.forecast_plot import plot_to_file
+from .modeling.forecast_batch import fit_forecasts
+from .modeling.forecast import Forecast
+from .modeling.forecast_cache import get_forecast_cache
+from .modeling.forecast_store import ForecastStore
 from .util import udatetime
 
 # import .util import
@@ -21,6 +26,85 @@ def is_missing(df: pd.DataFrame) -> bool:
         return True
 
 
+def run_vector_checks(check_rows: Callable, df: pd.DataFrame, config: QCConfig, *args) -> vector_checks.RowMessages:
+    " run the vectorized row checks, returns None to fall back to the per-row checks "
+    if not config.vectorized_checks:
+        return None
+    try:
+        return check_rows(df, config, *args)
+    except Exception as ex:
+        logger.exception(ex)
+        logger.warning("vectorized checks failed, fall back to per-row checks")
+        return None
+
+
+def batch_forecasts(ds: DataSource, target_date: int, config: QCConfig) -> Dict[str, Forecast]:
+    " fit the forecasts for all states at once, returns None to fit each state in the row loop "
+    if config.forecast_engine != "batch" or ds.history is None:
+        return None
+    try:
+        return fit_forecasts(ds.history, target_date, get_forecast_cache(), config.upper_model == "logistic")
+    except Exception as ex:
+        logger.exception(ex)
+        logger.warning("batch forecast failed, fall back to per-state fits")
+        return None
+
+
+def create_store(context: str, config: QCConfig) -> ForecastStore:
+    " store for the forecasts of this run, None if results are not saved or batch plotted "
+    if not config.save_results and not (config.plot_models and config.plot_mode == "batch"):
+        return None
+    return ForecastStore(config.results_dir, context, config.keep_runs)
+
+
+def save_store(store: ForecastStore, config: QCConfig, log: ResultLog):
+    if store is None or not config.save_results:
+        return
+    try:
+        store.save()
+    except Exception as ex:
+        logger.exception(ex)
+        log.internal("Forecast", f"Could not save forecasts: {ex}")
+
+
+def plot_store(store: ForecastStore, context: str, config: QCConfig, log: ResultLog):
+    " plot all the forecasts of the run on one figure (plot_mode = batch) "
+    if store is None or not config.plot_models or config.plot_mode != "batch" or len(store) == 0:
+        return
+    try:
+        checks.plot_forecasts(store.all(), f"{config.images_dir}/{context}", config)
+    except Exception as ex:
+        logger.exception(ex)
+        log.internal("Forecast", f"Could not plot forecasts: {ex}")
+
+
+def prepare_forecasts(df: pd.DataFrame, ds: DataSource, context: str, target_date: int,
+        config: QCConfig, last_changes: Dict, store: ForecastStore) -> Tuple[Dict[str, Forecast], Dict]:
+    """ fit the forecasts and, if there are workers, finish them in the process pool
+
+    returns the forecasts by state, states that are missing are fitted in the row loop,
+    and the increasing_values results of the forecast stage (see forecast_stage.replay_changes)
+    """
+    forecasts = batch_forecasts(ds, target_date, config)
+    if config.forecast_workers <= 0 or ds.history is None:
+        return forecasts, None
+
+    changes = None
+    try:
+        changes = forecast_stage.changed_states(df, ds.state_history, config, last_changes)
+        rows = [row for row in df.itertuples() if changes.get(row.Index, (False, None))[0]]
+        finished = forecast_stage.run_forecasts(rows, ds.state_history, context, config, forecasts, store)
+    except Exception as ex:
+        logger.exception(ex)
+        logger.warning("forecast stage failed, fall back to forecasts in the row loop")
+        return forecasts, changes
+
+    if forecasts:
+        forecasts.update(finished)
+        return forecasts, changes
+    return finished, changes
+
+
 def check_working(ds: DataSource, config: QCConfig) -> ResultLog:
     """
     Check unpublished results in the working google sheet
@@ -29,12 +113,15 @@ def check_working(ds: DataSource, config: QCConfig) -> ResultLog:
 
     log = ResultLog()
 
-    ds._target_date = config.working_date
+    if config.prefetch:
+        ds.prefetch(["working", "history", "counties"])
 
     df = ds.working
     if is_missing(df):
         log.internal("Source", "Working not available")
         return None
+    # ds can be shared with other runs, do not change its frames
+    df = df.copy()
     if is_missing(ds.history):
         log.internal("Source", "History not available")
     if is_missing(ds.county_rollup):
@@ -72,31 +159,47 @@ def check_working(ds: DataSource, config: QCConfig) -> ResultLog:
 
     # *** WHEN YOU CHANGE A CHECK THAT IMPACTS WORKING, MAKE SURE TO UPDATE THE EXCEL TRACKING DOCUMENT ***
 
+    row_messages = run_vector_checks(vector_checks.check_working_rows, df, config)
+    county_messages = None
+    if ds.county_rollup is not None:
+        county_messages = run_vector_checks(vector_checks.check_county_rows, df, config, ds.county_rollup)
+    last_changes = ds.last_changes(config.working_date_int)
+    store = create_store("working", config)
+    forecasts, changes = prepare_forecasts(df, ds, "working", config.working_date_int, config, last_changes, store)
+
     cnt = 0
     for row in df.itertuples():
         try:
 
-            # checks.total(row, log)
-            # checks.total_tests(row, log)
-            checks.last_update(row, log)
-            checks.last_checked(row, log, config)
-            checks.checkers_initials(row, log, config)
-            checks.positives_rate(row, log)
-            checks.death_rate(row, log)
-            # checks.less_recovered_than_positive(row, log)
-            checks.pendings_rate(row, log)
+            if row_messages is not None:
+                row_messages.emit(row.Index, log)
+            else:
+                # checks.total(row, log)
+                # checks.total_tests(row, log)
+                checks.last_update(row, log)
+                checks.last_checked(row, log, config)
+                checks.checkers_initials(row, log, config)
+                checks.positives_rate(row, log)
+                checks.death_rate(row, log)
+                # checks.less_recovered_than_positive(row, log)
+                checks.pendings_rate(row, log)
 
             if ds.history is not None:
-                df_history = ds.history[ds.history.state == row.state]
-                has_changed = checks.increasing_values(row, df_history, log, config)
+                df_history = ds.state_history(row.state)
+                has_changed = forecast_stage.replay_changes(row, changes, log)
+                if has_changed is None:
+                    has_changed = checks.increasing_values(row, df_history, log, config, last_changes)
                 if has_changed:
                     checks.expected_positive_increase(
-                        row, df_history, log, "working", config
+                        row, df_history, log, "working", config,
+                        forecasts.get(row.state) if forecasts else None, store
                     )
 
             # checks.delta_vs_cumulative(row, df_history, log, config)
 
-            if ds.county_rollup is not None:
+            if county_messages is not None:
+                county_messages.emit(row.Index, log)
+            elif ds.county_rollup is not None:
                 df_county_rollup = ds.county_rollup[ds.county_rollup.state == row.state]
                 if not df_county_rollup.empty:
                     checks.counties_rollup_to_state(row, df_county_rollup, log)
@@ -113,22 +216,21 @@ def check_working(ds: DataSource, config: QCConfig) -> ResultLog:
 
     checks.missing_tests(log)
 
+    save_store(store, config, log)
+    plot_store(store, "working", config, log)
+
     # run loop at end, insted of during run
-    if config.plot_models and config.save_results:
+    if config.plot_models and config.save_results and config.plot_mode != "batch":
         cnt = 0
         for row in df.itertuples():
             try:
-                forecast = load_forecast_hd5(
-                    config.results_dir, row.state, row.targetDate
-                )
+                forecast = store.get(row.state, row.targetDate)
                 if forecast is None:
                     logger.warning(
                         f"Could not load forecast for {row.state}/{row.targetDate}"
                     )
                 else:
-                    plot_to_file(
-                        forecast, f"{config.images_dir}/working", checks.FIT_THRESHOLDS
-                    )
+                    checks.plot_forecast(forecast, f"{config.images_dir}/working", config)
             except Exception as ex:
                 logger.exception(ex)
                 log.internal(row.state, f"{ex}")
@@ -148,47 +250,67 @@ def check_current(ds: DataSource, config: QCConfig) -> ResultLog:
 
     log = ResultLog()
 
+    if config.prefetch:
+        ds.prefetch(["current", "history", "counties"])
+
     df = ds.current
     if is_missing(df):
         log.internal("Source", "Current not available")
         return None
+    # ds can be shared with other runs, do not change its frames
+    df = df.copy()
 
     if is_missing(ds.history):
         log.internal("Source", "History not available")
     if is_missing(ds.county_rollup):
         log.internal("Source", "County Rollup not available")
 
-    ds._target_date = config.push_date
-
     df["targetDate"] = config.push_date_int
     df["targetDateEt"] = config.push_date
     df["lastCheckEt"] = config.push_date
     df["push_num"] = config.push_num
 
+    row_messages = run_vector_checks(vector_checks.check_current_rows, df, config)
+    county_messages = None
+    if ds.county_rollup is not None:
+        county_messages = run_vector_checks(vector_checks.check_county_rows, df, config, ds.county_rollup)
+    last_changes = ds.last_changes(config.push_date_int)
+    store = create_store("current", config)
+    forecasts, changes = prepare_forecasts(df, ds, "current", config.push_date_int, config, last_changes, store)
+
     for row in df.itertuples():
-        checks.total(row, log)
-        checks.last_update(row, log)
-        checks.positives_rate(row, log)
-        checks.death_rate(row, log)
-        checks.pendings_rate(row, log)
+        if row_messages is not None:
+            row_messages.emit(row.Index, log)
+        else:
+            checks.total(row, log)
+            checks.last_update(row, log)
+            checks.positives_rate(row, log)
+            checks.death_rate(row, log)
+            checks.pendings_rate(row, log)
 
         if ds.history is not None:
-            df_history = ds.history[ds.history.state == row.state]
+            df_history = ds.state_history(row.state)
             checks.consistent_with_history(row, df_history, log)
 
-        if ds.history is not None:
-            df_history = ds.history[ds.history.state == row.state]
-            has_changed = checks.increasing_values(row, df_history, log, config)
+            has_changed = forecast_stage.replay_changes(row, changes, log)
+            if has_changed is None:
+                has_changed = checks.increasing_values(row, df_history, log, config, last_changes)
             if has_changed:
                 checks.expected_positive_increase(
-                    row, df_history, log, "current", config
+                    row, df_history, log, "current", config,
+                    forecasts.get(row.state) if forecasts else None, store
                 )
 
-        if ds.county_rollup is not None:
+        if county_messages is not None:
+            county_messages.emit(row.Index, log)
+        elif ds.county_rollup is not None:
             df_county_rollup = ds.county_rollup[ds.county_rollup.state == row.state]
             if not df_county_rollup.empty:
                 checks.counties_rollup_to_state(row, df_county_rollup, log)
 
+    save_store(store, config, log)
+    plot_store(store, "current", config, log)
+
     log.consolidate()
     return log
 
@@ -205,9 +327,7 @@ def check_history(ds: DataSource) -> ResultLog:
         log.internal("Source", "History not available")
         return None
 
-    for state in df["state"].drop_duplicates().values:
-        state_df = df.loc[df["state"] == state]
-        checks.monotonically_increasing(state_df, log)
+    checks.monotonically_increasing_all(df, log)
 
     log.consolidate()
     return log
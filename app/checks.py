@@ -18,15 +18,17 @@ from datetime import datetime
 from loguru import logger
 import pandas as pd
 import numpy as np
-from typing import Tuple
+from typing import Dict, Tuple
 
 from app.util import udatetime
 
 from .qc_config import QCConfig
 from .log.result_log import ResultLog
-from .modeling.forecast import Forecast
-from .modeling.forecast_plot import plot_to_file
-from .modeling.forecast_io import save_forecast_hd5, load_forecast_hd5
+from .data.data_source import build_last_change_table
+from .modeling.forecast import Forecast, register_params, has_params
+from .modeling.forecast_cache import get_forecast_cache
+from .modeling.render_queue import get_render_queue
+from .modeling.forecast_store import ForecastStore
 
 START_OF_TIME = udatetime.naivedatetime_as_eastern(datetime(2020, 1, 2))
 
@@ -56,6 +58,14 @@ def missing_tests(log: ResultLog):
 # ----------------------------------------------------------------
 
 
+def bad_value_msg(name: str, val: int) -> str:
+    if val == -1000:
+        return f"{name} is blank"
+    if val == -1001:
+        return f"{name} is invalid"
+    return f"{name} is negative ({val})"
+
+
 def total(row, log: ResultLog):
     """Check that pendings, positive, and negative sum to the reported total"""
 
@@ -67,13 +77,6 @@ def total(row, log: ResultLog):
         row.total,
     )
 
-    def bad_value_msg(name: str, val: int) -> str:
-        if val == -1000:
-            return f"{name} is blank"
-        if val == -1001:
-            return f"{name} is invalid"
-        return f"{name} is negative ({val})"
-
     if n_pending == -1000:  # allow blanks
         n_pending = 0
 
@@ -356,14 +359,11 @@ IGNORE_THRESHOLDS = {
 }
 
 
-def find_last_change(val, vec_vals: pd.Series, vec_date) -> Tuple[int, datetime]:
-    vals = vec_vals.values
-    for i in range(len(vals)):
-        if vals[i] != val:
-            sdate = str(vec_date.values[i])
-            d = datetime(int(sdate[0:4]), int(sdate[4:6]), int(sdate[6:8]))
-            return vals[i], udatetime.naivedatetime_as_eastern(d)
-    return 0, None
+def date_from_int(d: int) -> datetime:
+    " convert YYYYmmdd to an eastern datetime "
+    sdate = str(d)
+    d = datetime(int(sdate[0:4]), int(sdate[4:6]), int(sdate[6:8]))
+    return udatetime.naivedatetime_as_eastern(d)
 
 
 def consistent_with_history(row, df: pd.DataFrame, log: ResultLog) -> bool:
@@ -381,20 +381,25 @@ def consistent_with_history(row, df: pd.DataFrame, log: ResultLog) -> bool:
 
 
 def increasing_values(
-    row, df: pd.DataFrame, log: ResultLog, config: QCConfig = None
+    row, df: pd.DataFrame, log: ResultLog, config: QCConfig = None,
+    last_changes: Dict[Tuple[str, str], Dict] = None
 ) -> bool:
     """Check that new values more than previous values
 
     df contains the historical values (newest first).  offset controls how many days to look back.
     consolidate lines if everything changed
 
+    last_changes is the (state, metric) lookup from DataSource.last_changes for row.targetDate,
+    it is built from df if it is not passed in.
+
     return False if it looks like we have no new data for this source so we can bypass other tests
     """
 
     if not config:
         config = QCConfig()
 
-    df = df[df.date < row.targetDate]
+    if last_changes is None:
+        last_changes = build_last_change_table(df, row.targetDate).to_dict("index")
 
     dict_row = row._asdict()
 
@@ -411,9 +416,7 @@ def increasing_values(
     d_updated = last_updated.year * 10000 + last_updated.month * 100 + last_updated.day
 
     # target date of run
-    s_target = str(row.targetDate)
-    d_target = datetime(int(s_target[0:4]), int(s_target[4:6]), int(s_target[6:8]))
-    d_target = udatetime.naivedatetime_as_eastern(d_target)
+    d_target = date_from_int(row.targetDate)
 
     d_last_change = udatetime.naivedatetime_as_eastern(datetime(2020, 1, 1))
 
@@ -450,10 +453,13 @@ def increasing_values(
                 logger.debug(f"  {c} missing history column")
             continue
 
-        vec = df[c].values
+        x = last_changes.get((row.state, c))
+        if x is None:
+            prev_val, prev_date, changed_date, first_date = 0, 0, 0, 0
+        else:
+            prev_val, prev_date, changed_date, first_date = \
+                x["prev_value"], x["prev_date"], x["changed_date"], x["first_date"]
 
-        prev_val = vec[0] if vec.size > 0 else 0
-        prev_date = df["date"].iloc[0] if vec.size > 0 else 0
         if val < prev_val and (
             val > 0 and prev_val != 0
         ):  # negative values indicate blank/errors
@@ -486,45 +492,46 @@ def increasing_values(
             continue
 
         if val == prev_val:
-            changed_val, changed_date = find_last_change(val, df[c], df["date"])
+            if changed_date == 0:
+                if first_date > 0:
+                    d_last_change = max(d_last_change, date_from_int(first_date))
+                has_issues, consolidate = True, False
+                log.data_source(row.state, f"{c} ({val:,}) constant for all time")
+                if debug:
+                    logger.debug(f"  {c} ({val:,}) constant -> force individual lines ")
+                continue
 
+            changed_date = date_from_int(changed_date)
             n_days = int((d_target - changed_date).total_seconds() // (60 * 60 * 24))
 
             # ignore 2-day stale if not near release
             if not config.is_near_release and n_days < 3:
                 continue
 
-            if n_days >= 0:
-                d_last_change = max(d_last_change, changed_date)
+            d_last_change = max(d_last_change, changed_date)
 
-                source_messages.append(
-                    f"{c} ({val:,}) hasn't changed since {changed_date.month}/{changed_date.day} ({n_days} days)"
-                )
+            source_messages.append(
+                f"{c} ({val:,}) hasn't changed since {changed_date.month}/{changed_date.day} ({n_days} days)"
+            )
 
-                # check if we can still consolidate results
-                if n_days_prev == 0:
-                    n_days_prev = n_days
-                    if debug:
-                        logger.debug(
-                            f"  {c} ({val:,}) hasn't changed since {changed_date.month}/{changed_date.day} ({n_days} days)"
-                        )
-                elif n_days_prev == n_days:
-                    if debug:
-                        logger.debug(
-                            f"  {c} ({val:,}) also hasn't changed since {changed_date.month}/{changed_date.day}"
-                        )
-                else:
-                    consolidate = False
-                    if debug:
-                        logger.debug(
-                            f"  {c} ({val:,}) hasn't changed since {changed_date.month}/{changed_date.day} ({n_days} days ago) -> force individual lines "
-                        )
+            # check if we can still consolidate results
+            if n_days_prev == 0:
+                n_days_prev = n_days
+                if debug:
+                    logger.debug(
+                        f"  {c} ({val:,}) hasn't changed since {changed_date.month}/{changed_date.day} ({n_days} days)"
+                    )
+            elif n_days_prev == n_days:
+                if debug:
+                    logger.debug(
+                        f"  {c} ({val:,}) also hasn't changed since {changed_date.month}/{changed_date.day}"
+                    )
             else:
-                d_last_change = max(d_last_change, df["date"].values[-1])
-                has_issues, consolidate = True, False
-                log.data_source(row.state, f"{c} ({val:,}) constant for all time")
+                consolidate = False
                 if debug:
-                    logger.debug(f"  {c} ({val:,}) constant -> force individual lines ")
+                    logger.debug(
+                        f"  {c} ({val:,}) hasn't changed since {changed_date.month}/{changed_date.day} ({n_days} days ago) -> force individual lines "
+                    )
         else:
             consolidate = False
             if debug:
@@ -659,30 +666,45 @@ def monotonically_increasing(df: pd.DataFrame, log: ResultLog):
     Input is expected to be the values for a single state
     """
 
-    columns_to_check = ["positive", "negative", "hospitalized", "death"]
-
     state = df["state"].min()
     if state != df["state"].max():
         raise Exception("Expected input to be for a single state")
 
-    # TODO: don't group on state -- this is already filtered to a single state
+    monotonically_increasing_all(df, log)
+
+
+def monotonically_increasing_all(df: pd.DataFrame, log: ResultLog):
+    """Check that timeseries values are monotonically increasing for all states
+
+    Sorts once and compares each day to the previous day of the same state
+    in a single pass, then reports the decrease dates grouped by state.
+    """
+
+    columns_to_check = ["positive", "negative", "hospitalized", "death"]
+
     df = df.sort_values(["state", "date"], ascending=True)
-    df_lagged = (
-        df.groupby("state")[columns_to_check]
-        .shift(1)
-        .rename(columns=lambda c: c + "_lag")
-    )
+    states = df["state"].astype(str).values
+    dates = df["date"].values
 
-    df_comparison = df.merge(df_lagged, left_index=True, right_index=True, how="left")
+    # row i is compared to row i-1 when both are for the same state
+    same_state = states[1:] == states[:-1]
 
-    # check that all the counts are >= the previous day
+    errors = {}
     for col in columns_to_check:
-        if (df_comparison[f"{col}_lag"] > df_comparison[col]).any():
-            error_dates = df_comparison.loc[
-                (df_comparison[f"{col}_lag"] > df_comparison[col])
-            ]["date"]
-            error_dates_str = error_dates.astype(str).str.cat(sep=", ")
+        vals = df[col].values
+        decreased = np.zeros(vals.shape[0], dtype=bool)
+        decreased[1:] = same_state & (vals[:-1] > vals[1:])
 
+        for state, date in zip(states[decreased], dates[decreased]):
+            errors.setdefault(state, {}).setdefault(col, []).append(str(date))
+
+    # check that all the counts are >= the previous day
+    for state in sorted(errors):
+        for col in columns_to_check:
+            error_dates = errors[state].get(col)
+            if error_dates is None: continue
+
+            error_dates_str = ", ".join(error_dates)
             log.data_quality(
                 state,
                 f"{col} values decreased from the previous day (on {error_dates_str})",
@@ -694,8 +716,65 @@ def monotonically_increasing(df: pd.DataFrame, log: ResultLog):
 FIT_THRESHOLDS = [0.9, 1.2]
 
 
+def plot_forecast(forecast: Forecast, image_dir: str, config: QCConfig):
+    " plot the forecast, in the background if there are render workers "
+    if config.render_workers > 0:
+        get_render_queue(config.render_workers).submit(forecast, image_dir, FIT_THRESHOLDS)
+    else:
+        # matplotlib is slow to import, only load it when plotting
+        from .modeling.forecast_plot import plot_to_file
+        plot_to_file(forecast, image_dir, FIT_THRESHOLDS)
+
+
+def plot_forecasts(forecasts: list, image_dir: str, config: QCConfig):
+    " plot all the forecasts on one figure, in the background if there are render workers "
+    if config.render_workers > 0:
+        get_render_queue(config.render_workers).submit_all(forecasts, image_dir, FIT_THRESHOLDS, config.plot_thumbnails)
+    else:
+        from .modeling.forecast_plot import plot_all_to_file
+        plot_all_to_file(forecasts, image_dir, FIT_THRESHOLDS, config.plot_thumbnails)
+
+
+def run_forecast(
+    row, history: pd.DataFrame, context: str, config: QCConfig, forecast: Forecast = None,
+    store: ForecastStore = None
+) -> Forecast:
+    """
+    Fit (unless forecast is already fitted), project, save and plot the forecast for row.
+
+    row only needs state, targetDate and positive.  the forecast is added to store
+    (if there is one), the caller saves or plots the store at the end of the run.
+    """
+
+    history = history.loc[history["date"] != row.targetDate]
+
+    if forecast is None:
+        # seed the registry from the last saved results so the exp fit can warm-start
+        if store is not None and not has_params(row.state):
+            register_params(store.find_last(row.state, row.targetDate))
+
+        forecast = Forecast()
+        forecast.date = row.targetDate
+        forecast.fit(history, get_forecast_cache(), config.upper_model == "logistic")
+        if forecast.fit_stats and config.enable_debug:
+            stats = forecast.fit_stats
+            logger.debug(
+                f"{forecast.state}: exp fit nfev={stats['exp_nfev']} in {stats['exp_seconds']:.3f}s"
+                f" (warm={stats['warm_start']}), linear fit nfev={stats['linear_nfev']} in {stats['linear_seconds']:.3f}s"
+            )
+    forecast.project(row)
+
+    if store is not None:
+        store.add(forecast)
+    if config.plot_models and not config.save_results and config.plot_mode != "batch":
+        plot_forecast(forecast, f"{config.images_dir}/{context}", config)
+
+    return forecast
+
+
 def expected_positive_increase(
-    row, history: pd.DataFrame, log: ResultLog, context: str, config: QCConfig = None
+    row, history: pd.DataFrame, log: ResultLog, context: str, config: QCConfig = None,
+    forecast: Forecast = None, store: ForecastStore = None
 ):
     """
     Fit state-level daily positives data to an exponential and a linear curve.
@@ -704,9 +783,12 @@ def expected_positive_increase(
 
     The exponential is used as the upper bound. The linear is used as the lower bound.
 
-    TODO: Eventually these curves will NOT be exp (perhaps logistic?)
-          Useful to know which curves have been "leveled" but from a
-          data quality perspective, this check would become annoying
+    config.upper_model = logistic uses a logistic curve as the upper bound instead,
+    it follows the states that have "leveled" off.
+
+    forecast is either a fitted model for the state (see forecast_batch.fit_forecasts)
+    or a finished one (see forecast_stage.run_forecasts), if it is missing the model
+    is fitted here.
     """
 
     if not config:
@@ -714,21 +796,18 @@ def expected_positive_increase(
 
     current = row  # this is an iterrows() record, not a data frame
 
-    forecast = Forecast()
-    forecast.date = current.targetDate
+    if forecast is None or forecast.projection_index is None:
+        forecast = run_forecast(current, history, context, config, forecast, store)
 
-    history = history.loc[history["date"] != forecast.date]
-
-    forecast.fit(history)
-    forecast.project(current)
-
-    if config.save_results:
-        save_forecast_hd5(forecast, config.results_dir)
-    elif config.plot_models:
-        plot_to_file(forecast, f"{config.images_dir}/{context}", FIT_THRESHOLDS)
+    history = history.loc[history["date"] != current.targetDate]
 
     actual_value, expected_linear, expected_exp = forecast.results
 
+    # the upper bound is the exp (default) or the logistic model
+    expected_exp = forecast.expected_upper(config.upper_model)
+    upper_name = "logistic" if config.upper_model == "logistic" \
+        and forecast.fitted_logistic_params is not None else "exponential"
+
     # limit to N >= 300
     if actual_value < 300:
         return
@@ -752,20 +831,20 @@ def expected_positive_increase(
         is_bad = True
     if 100 < expected_linear > 100_000:
         logger.error(
-            f"{forecast.state}: actual = {actual_value:,}, exponental model = {expected_exp:,} "
+            f"{forecast.state}: actual = {actual_value:,}, {upper_name} model = {expected_exp:,} "
         )
         log.internal(
             forecast.state,
-            f"actual = {actual_value:,}, exponental model = {expected_exp:,} ",
+            f"actual = {actual_value:,}, {upper_name} model = {expected_exp:,} ",
         )
         is_bad = True
     if (not is_bad) and (expected_linear >= expected_exp):
         logger.error(
-            f"{forecast.state}: actual = {actual_value:,}, linear model ({expected_linear:,}) > exponental model ({expected_exp:,})"
+            f"{forecast.state}: actual = {actual_value:,}, linear model ({expected_linear:,}) > {upper_name} model ({expected_exp:,})"
         )
         log.internal(
             forecast.state,
-            f"actual = {actual_value:,}, linear model ({expected_linear:,}) > exponental model ({expected_exp:,})",
+            f"actual = {actual_value:,}, linear model ({expected_linear:,}) > {upper_name} model ({expected_exp:,})",
         )
         is_bad = True
 
@@ -799,7 +878,7 @@ def expected_positive_increase(
         else:
             log.data_quality(
                 forecast.state,
-                f"positive ({actual_value:,}){sd} accelerated beyond exponential trend, expected < {max_value:,}",
+                f"positive ({actual_value:,}){sd} accelerated beyond {upper_name} trend, expected < {max_value:,}",
             )
 
     # if the linear projection is steeper than the exp let's
@@ -820,5 +899,5 @@ def expected_positive_increase(
             else:
                 log.data_quality(
                     forecast.state,
-                    f"positive ({actual_value:,}){sd} accelerated beyond exponential trend, expected < {high_linear:,}",
+                    f"positive ({actual_value:,}){sd} accelerated beyond {upper_name} trend, expected < {high_linear:,}",
                 )
@@ -8,44 +8,199 @@
 # This module is responsible for type conversion and renaming the fields for consistency.
 #
 
-from typing import List, Dict
+from typing import List, Dict, IO, Callable, Tuple
 from loguru import logger
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+import time
 import pandas as pd
-from urllib.request import urlopen
 import json
 import numpy as np
 import re
-import requests
 import socket
-import io
 
 from app.util import state_abbrevs
 import app.util.udatetime as udatetime
-from app.data.worksheet_wrapper import WorksheetWrapper
+from app.data.remote_cache import get_cache
 from app.log.error_log import ErrorLog
 
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
 KEY_PATH = "credentials-scanner.json"
 
-def get_remote_csv(xurl: str) -> pd.DataFrame:
-    r = requests.get(xurl, timeout=1)
-    if r.status_code >= 300:
-        raise Exception(f"Could not get {xurl}, status={r.status_code}")
-    f = io.StringIO(r.text)
-    df = pd.read_csv(f)
+# columns of us-counties.csv used by the county rollup
+NYT_COLUMNS = ["date", "county", "state", "fips", "cases", "deaths"]
+NYT_CHUNK_SIZE = 100_000
+
+def _parse_nyt_last_date(f: IO) -> pd.DataFrame:
+    """ stream the NYT counties history and keep the rows for the newest date
+
+    memory is bounded by the chunk size instead of the length of the history
+    """
+    last_date, frames = "", []
+    for chunk in pd.read_csv(f, usecols=NYT_COLUMNS, chunksize=NYT_CHUNK_SIZE):
+        d = chunk["date"].max()
+        if d > last_date:
+            last_date, frames = d, [chunk[chunk["date"] == d]]
+        elif d == last_date:
+            frames.append(chunk[chunk["date"] == d])
+
+    if len(frames) == 0:
+        return pd.DataFrame(columns=NYT_COLUMNS)
+    return pd.concat(frames, axis=0, ignore_index=True)
+
+# API schemas -- only the columns the checks use, with compact types.
+#
+#   counts can be blank so they are read as floats and converted
+#   to int32 (blank=0) as a single block.
+#
+
+API_COUNTS = ["positive", "negative", "pending", "hospitalized", "death", "recovered",
+    "total", "totalTestResults", "hospitalizedCumulative", "inIcuCumulative", "onVentilatorCumulative"]
+
+HISTORY_SCHEMA = {
+    "date": "int32",
+    "state": "category",
+    "dateChecked": "object",
+    **{c: "float64" for c in API_COUNTS},
+}
+
+# 0 or 1.  score = sum of others so it is 0-4
+CURRENT_SCORES = ["positiveScore", "negativeScore", "negativeRegularScore", "commercialScore", "score"]
+
+CURRENT_SCHEMA = {
+    "state": "category",
+    "lastUpdateEt": "object",
+    "checkTimeEt": "object",
+    "dateModified": "object",
+    "dateChecked": "object",
+    **{c: "float64" for c in API_COUNTS},
+    **{c: "float64" for c in CURRENT_SCORES},
+}
+
+def _read_typed_csv(f: IO, schema: Dict[str, str], int_columns: List[str], date_columns: List[str]) -> pd.DataFrame:
+    " read the schema columns in one pass and convert blank counts to zero "
+
+    df = pd.read_csv(f, usecols=lambda c: c in schema, dtype=schema, parse_dates=date_columns)
+
+    int_columns = [c for c in int_columns if c in df.columns]
+    df[int_columns] = df[int_columns].fillna(0).astype(np.int32)
+    df["state"] = df["state"].cat.as_ordered()
+    return df
+
+def _parse_history(f: IO) -> pd.DataFrame:
+    return _read_typed_csv(f, HISTORY_SCHEMA, API_COUNTS, ["dateChecked"])
+
+def _parse_current(f: IO) -> pd.DataFrame:
+    df = _read_typed_csv(f, CURRENT_SCHEMA, API_COUNTS + CURRENT_SCORES, ["dateModified", "dateChecked"])
+
+    # times are "mm/dd hh:mm" in eastern
+    for c in ["lastUpdateEt", "checkTimeEt"]:
+        df[c] = pd.to_datetime(df[c].str.replace(" ", "/2020 "), format="%m/%d/%Y %H:%M") \
+            .dt.tz_localize(udatetime.eastern_tz)
     return df
 
+# cumulative metrics that are expected to change every day
+LAST_CHANGE_METRICS = ["positive", "negative", "death",
+    "hospitalizedCumulative", "inIcuCumulative", "onVentilatorCumulative"]
+
+def build_last_change_table(history: pd.DataFrame, target_date: int) -> pd.DataFrame:
+    """ build a table with one row per (state, metric) from the history before target_date
+
+    columns are:
+        prev_value/prev_date       -- the newest value and its date
+        changed_value/changed_date -- the newest older value that differs from prev_value (0 if none)
+        first_date                 -- the oldest date for the state
+    """
+
+    metrics = [c for c in LAST_CHANGE_METRICS if c in history.columns]
+
+    df = history.loc[history["date"] < target_date, ["state", "date"] + metrics]
+    df = df.assign(state=df["state"].astype(str)) \
+        .melt(id_vars=["state", "date"], var_name="metric", value_name="value") \
+        .sort_values(["state", "metric", "date"], ascending=[True, True, False])
+
+    keys = ["state", "metric"]
+    g = df.groupby(keys, sort=False)
+    newest = g.head(1).set_index(keys)
+    oldest = g.tail(1).set_index(keys)
+
+    is_changed = df["value"].values != g["value"].transform("first").values
+    last_change = df[is_changed].groupby(keys, sort=False).head(1).set_index(keys)
+
+    table = pd.DataFrame({
+        "prev_value": newest["value"],
+        "prev_date": newest["date"],
+        "first_date": oldest["date"],
+    })
+    table["changed_value"] = last_change["value"].reindex(table.index, fill_value=0)
+    table["changed_date"] = last_change["date"].reindex(table.index, fill_value=0)
+    return table
+
+def _parse_json(f: IO) -> Dict:
+    return json.loads(f.read().decode('utf-8', 'replace'))
+
+def get_remote_csv(xurl: str, parse: Callable[[IO], pd.DataFrame] = pd.read_csv, parse_key: str = "csv") -> pd.DataFrame:
+    """ get a csv through the remote cache, returns a copy that is safe to change
+
+    parse/parse_key replace the default pd.read_csv for loaders that only need part of the file
+    """
+    df = get_cache().load(xurl, parse, parse_key)
+    return df.copy()
+
+def get_remote_json(xurl: str) -> Dict:
+    " get json through the remote cache, do not change the result "
+    return get_cache().load(xurl, _parse_json, "json")
+
+
+
+# names accepted by DataSource.prefetch, "counties" expands to the three county feeds
+PREFETCH_GROUPS = {
+    "counties": ["cds_counties", "csbs_counties", "nyt_counties"],
+}
+
+# sources with a TTL (see DataSource.refreshed) and their attributes
+SOURCE_GROUPS = {
+    "working": ["working"],
+    "current": ["current"],
+    "history": ["history"],
+    "counties": ["cds_counties", "csbs_counties", "nyt_counties"],
+}
+
+# failed keys of the county feeds
+COUNTY_SOURCES = ["CDS", "CSBS", "NYT"]
+
+# seconds before a source is reloaded
+DEFAULT_TTLS = {
+    "working": 60,
+    "current": 60,
+    "history": 60 * 60,
+    "counties": 60 * 60,
+}
 
 
 class DataSource:
+    """ lazily loaded datasets
+
+    once a source is loaded it does not change, so one DataSource can be shared
+    by several check runs (see refreshed).  the checks copy a frame before changing it.
+    """
 
-    def __init__(self):
+    def __init__(self, version: int = 1):
 
         self._target_date = None
-        self.log = ErrorLog()
+
+        # one log per source group so a failed source only shows up in the runs that use it
+        self.logs: Dict[str, ErrorLog] = {group: ErrorLog() for group in SOURCE_GROUPS}
 
         self.failed = {}
 
+        # bumped by refreshed() each time a source is reloaded
+        self.version = version
+        # source -> time.time() when it was loaded
+        self.loaded_at: Dict[str, float] = {}
+        self._locks = {name: Lock() for group in SOURCE_GROUPS.values() for name in group}
+        self._locks["county_rollup"] = Lock()
+
         # worksheet dates
         self.last_publish_time = ""
         self.last_push_time = ""
@@ -56,6 +211,10 @@ class DataSource:
         self._history: pd.DataFrame = None
         self._current: pd.DataFrame = None
 
+        # derived from history
+        self._history_by_state: Dict[str, pd.DataFrame] = None
+        self._last_changes: Dict[int, Dict] = {}
+
         # external datasources
         self._cds_counties: pd.DataFrame = None
         self._csbs_counties: pd.DataFrame = None
@@ -66,91 +225,142 @@ class DataSource:
     def working(self) -> pd.DataFrame:
         " the working dataset"
         if self._working is None:
-            if self.failed.get("working"): return None
-            try:
-                self._working = self.load_working()
-            except socket.timeout:
-                self.failed["working"] = True
-                self.log.error(f"Could not fetch working")
-            except Exception as ex:
-                logger.exception(ex)
-                self.failed["working"] = True
-                self.log.error(f"Could not load working", exception=ex)
+            with self._locks["working"]:
+                if self._working is not None: return self._working
+                if self.failed.get("working"): return None
+                try:
+                    self._working = self.load_working()
+                    self.loaded_at["working"] = time.time()
+                except socket.timeout:
+                    self.failed["working"] = True
+                    self.logs["working"].error(f"Could not fetch working")
+                except Exception as ex:
+                    logger.exception(ex)
+                    self.failed["working"] = True
+                    self.logs["working"].error(f"Could not load working", exception=ex)
         return self._working
 
     @property
     def history(self) -> pd.DataFrame:
         " the daily history dataset"
         if self._history is None:
-            if self.failed.get("history"): return None
-            try:
-                self._history = self.load_history()
-            except socket.timeout:
-                self.failed["history"] = True
-                self.log.error(f"Could not fetch history")
-            except Exception as ex:
-                self.failed["history"] = True
-                self.log.error(f"Could not load history", exception=ex)
+            with self._locks["history"]:
+                if self._history is not None: return self._history
+                if self.failed.get("history"): return None
+                try:
+                    self._history = self.load_history()
+                    self.loaded_at["history"] = time.time()
+                except socket.timeout:
+                    self.failed["history"] = True
+                    self.logs["history"].error(f"Could not fetch history")
+                except Exception as ex:
+                    self.failed["history"] = True
+                    self.logs["history"].error(f"Could not load history", exception=ex)
         return self._history
 
+    @property
+    def history_by_state(self) -> Dict[str, pd.DataFrame]:
+        " the history split by state (newest first), built once per load "
+        if self._history_by_state is None:
+            df = self.history
+            if df is None: return None
+
+            df = df.sort_values(["state", "date"], ascending=[True, False])
+            self._history_by_state = { str(state): x for state, x in df.groupby("state", observed=True, sort=False) }
+        return self._history_by_state
+
+    def state_history(self, state: str) -> pd.DataFrame:
+        " the history for a single state (newest first) "
+        by_state = self.history_by_state
+        if by_state is None: return None
+
+        df = by_state.get(state)
+        if df is None:
+            return self.history.iloc[0:0]
+        return df
+
+    def last_changes(self, target_date: int) -> Dict[Tuple[str, str], Dict]:
+        """ the last change table for target_date as a {(state, metric): row} lookup,
+        built once per target date (see build_last_change_table) """
+        x = self._last_changes.get(target_date)
+        if x is None:
+            df = self.history
+            if df is None: return None
+
+            x = build_last_change_table(df, target_date).to_dict("index")
+            self._last_changes[target_date] = x
+        return x
+
     @property
     def current(self) -> pd.DataFrame:
         " today's dataset"
         if self._current is None:
-            if self.failed.get("current"): return None
-            try:
-                self._current = self.load_current()
-            except socket.timeout:
-                self.failed["current"] = True
-                self.log.error(f"Could not fetch current")
-            except Exception as ex:
-                self.failed["current"] = True
-                self.log.error("Could not load current", exception=ex)
+            with self._locks["current"]:
+                if self._current is not None: return self._current
+                if self.failed.get("current"): return None
+                try:
+                    self._current = self.load_current()
+                    self.loaded_at["current"] = time.time()
+                except socket.timeout:
+                    self.failed["current"] = True
+                    self.logs["current"].error(f"Could not fetch current")
+                except Exception as ex:
+                    self.failed["current"] = True
+                    self.logs["current"].error("Could not load current", exception=ex)
         return self._current
 
     @property
     def cds_counties(self) -> pd.DataFrame:
         " the CDS counties dataset"
         if self._cds_counties is None:
-            if self.failed.get("CDS"): return None
-            try:
-                self._cds_counties = self.load_cds_counties()
-            except socket.timeout:
-                self.failed["CDS"] = True
-                self.log.warning(f"Could not fetch CDS counties")
-            except Exception as ex:
-                self.failed["CDS"] = True
-                self.log.warning("Could not load CDS counties", exception=ex)
+            with self._locks["cds_counties"]:
+                if self._cds_counties is not None: return self._cds_counties
+                if self.failed.get("CDS"): return None
+                try:
+                    self._cds_counties = self.load_cds_counties()
+                    self.loaded_at["cds_counties"] = time.time()
+                except socket.timeout:
+                    self.failed["CDS"] = True
+                    self.logs["counties"].warning(f"Could not fetch CDS counties")
+                except Exception as ex:
+                    self.failed["CDS"] = True
+                    self.logs["counties"].warning("Could not load CDS counties", exception=ex)
         return self._cds_counties
 
     @property
     def csbs_counties(self) -> pd.DataFrame:
         " the CSBS counties dataset"
         if self._csbs_counties is None:
-            if self.failed.get("CSBS"): return None
-            try:
-                self._csbs_counties = self.load_csbs_counties()
-            except socket.timeout:
-                self.failed["CSBS"] = True
-                self.log.warning(f"Could not fetch CSBS counties")
-            except Exception as ex:
-                self.failed["CSBS"] = True
-                self.log.warning(f"Could not load CSBS counties", exception=ex)
+            with self._locks["csbs_counties"]:
+                if self._csbs_counties is not None: return self._csbs_counties
+                if self.failed.get("CSBS"): return None
+                try:
+                    self._csbs_counties = self.load_csbs_counties()
+                    self.loaded_at["csbs_counties"] = time.time()
+                except socket.timeout:
+                    self.failed["CSBS"] = True
+                    self.logs["counties"].warning(f"Could not fetch CSBS counties")
+                except Exception as ex:
+                    self.failed["CSBS"] = True
+                    self.logs["counties"].warning(f"Could not load CSBS counties", exception=ex)
         return self._csbs_counties
 
     @property
     def nyt_counties(self) -> pd.DataFrame:
         " the NYT counties dataset"
         if self._nyt_counties is None:
-            if self.failed.get("NYT"): return None
-            try:
-                self._nyt_counties = self.load_nyt_counties()
-            except socket.timeout:
-                self.failed["NYT"] = True
-                self.log.warning(f"Could not fetch NYT counties")
-            except Exception as ex:
-                self.failed["NYT"] = True
-                self.log.warning(f"Could not load NYT counties", exception=ex)
+            with self._locks["nyt_counties"]:
+                if self._nyt_counties is not None: return self._nyt_counties
+                if self.failed.get("NYT"): return None
+                try:
+                    self._nyt_counties = self.load_nyt_counties()
+                    self.loaded_at["nyt_counties"] = time.time()
+                except socket.timeout:
+                    self.failed["NYT"] = True
+                    self.logs["counties"].warning(f"Could not fetch NYT counties")
+                except Exception as ex:
+                    self.failed["NYT"] = True
+                    self.logs["counties"].warning(f"Could not load NYT counties", exception=ex)
         return self._nyt_counties
 
     @property
@@ -160,28 +370,114 @@ class DataSource:
         metrics = ["cases", "deaths","recovered"]
 
         if self._county_rollup is None:
-            if len(self.failed) > 0: return None
-
-            frames = [self.cds_counties, self.csbs_counties, self.nyt_counties]
-            if self.log.has_error:
-                self.failed["counties"] = True
-                logger.warning("Could not load datasets for " + ",".join(self.failed))
-                return None
-
-            try:
-                long_df = pd.concat(frames, axis=0, sort=False)
-
-                self._county_rollup = long_df \
-                    .groupby(["state", "source"])[metrics] \
-                    .sum() \
-                    .fillna(0) \
-                    .astype(int) \
-                    .reset_index()
-            except Exception as ex:
-                self.log.warning(f"Could not combine counties datasets: {ex}")
+            with self._locks["county_rollup"]:
+                if self._county_rollup is not None: return self._county_rollup
+                if self.failed.get("counties"): return None
+
+                frames = [self.cds_counties, self.csbs_counties, self.nyt_counties]
+                failed = [k for k in COUNTY_SOURCES if self.failed.get(k)]
+                if len(failed) > 0 or self.logs["counties"].has_error:
+                    self.failed["counties"] = True
+                    logger.warning("Could not load datasets for " + ",".join(failed))
+                    return None
+
+                try:
+                    long_df = pd.concat(frames, axis=0, sort=False)
+
+                    self._county_rollup = long_df \
+                        .groupby(["state", "source"])[metrics] \
+                        .sum() \
+                        .fillna(0) \
+                        .astype(int) \
+                        .reset_index()
+                except Exception as ex:
+                    self.logs["counties"].warning(f"Could not combine counties datasets: {ex}")
 
         return self._county_rollup
 
+    @property
+    def log(self) -> ErrorLog:
+        " the messages of all the sources "
+        return self.log_for(list(SOURCE_GROUPS))
+
+    def log_for(self, groups: List[str]) -> ErrorLog:
+        " the messages of some source groups (see SOURCE_GROUPS) "
+        log = ErrorLog()
+        for group in groups:
+            x = self.logs[group]
+            log.has_error = log.has_error or x.has_error
+            log.messages.extend(x.messages)
+        return log
+
+    def refreshed(self, ttls: Dict[str, int] = None) -> "DataSource":
+        """ get a DataSource with the expired sources dropped
+
+        sources that are younger than their TTL (and derived data like the
+        per-state history) are shared with the new DataSource, the others reload
+        on first use.  returns self if nothing has expired.
+        """
+
+        if ttls is None: ttls = DEFAULT_TTLS
+        now = time.time()
+
+        def is_expired(group: str) -> bool:
+            for name in SOURCE_GROUPS[group]:
+                t = self.loaded_at.get(name)
+                if t is not None and now - t > ttls.get(group, DEFAULT_TTLS[group]):
+                    return True
+            return False
+
+        expired = [g for g in SOURCE_GROUPS if is_expired(g)]
+        if len(expired) == 0 and len(self.failed) == 0:
+            return self
+
+        ds = DataSource(self.version + 1)
+        logger.info(f"data version {ds.version}: reload {', '.join(expired + list(self.failed))}")
+
+        # keep the sources that loaded cleanly, with their own messages
+        for group, names in SOURCE_GROUPS.items():
+            if group in expired or self._group_failed(group): continue
+            for name in names:
+                value = getattr(self, f"_{name}")
+                if value is None: continue
+                setattr(ds, f"_{name}", value)
+                ds.loaded_at[name] = self.loaded_at[name]
+            ds.logs[group] = self.logs[group]
+
+        if ds._working is not None:
+            ds.last_publish_time = self.last_publish_time
+            ds.last_push_time = self.last_push_time
+            ds.current_time = self.current_time
+        if ds._history is not None:
+            ds._history_by_state = self._history_by_state
+            ds._last_changes = self._last_changes
+        if "counties" not in expired and not self._group_failed("counties"):
+            ds._county_rollup = self._county_rollup
+        return ds
+
+    def _group_failed(self, group: str) -> bool:
+        if group == "counties":
+            return any(self.failed.get(k) for k in COUNTY_SOURCES + ["counties"])
+        return bool(self.failed.get(group))
+
+    def prefetch(self, names: List[str]) -> None:
+        """ load several sources at the same time
+
+        each source is loaded through its property on a worker thread so the
+        normal failed/ErrorLog handling still applies.  wall-clock time is the
+        slowest source instead of the sum of all of them.
+        """
+
+        props = []
+        for n in names:
+            for p in PREFETCH_GROUPS.get(n, [n]):
+                if not p in props: props.append(p)
+        if len(props) == 0: return
+
+        logger.info(f"prefetch {', '.join(props)}")
+        with ThreadPoolExecutor(max_workers=len(props)) as executor:
+            list(executor.map(lambda p: getattr(self, p), props))
+
     def safe_convert_to_int(self, df: pd.DataFrame, col_name: str) -> pd.Series:
         " convert a series to int even if it contains bad data"
         try:
@@ -203,7 +499,7 @@ class DataSource:
             for idx, e_row in df_errs.iterrows():
                 v = e_row[col_name]
                 v2 = s[idx]
-                self.log.error(f"Invalid {col_name} value ({v} -> {v2}) for {e_row.state}")
+                self.logs["working"].error(f"Invalid {col_name} value ({v} -> {v2}) for {e_row.state}")
 
             s = s.where(is_bad, other="-1001")
             return s.astype(np.int)
@@ -335,6 +631,8 @@ class DataSource:
         }
 
 
+        # the google api client is slow to import, only load it for the working sheet
+        from app.data.worksheet_wrapper import WorksheetWrapper
         gs = WorksheetWrapper()
         dev_id = gs.get_sheet_id_by_name("dev")
 
@@ -462,46 +760,16 @@ class DataSource:
     def load_current(self) -> pd.DataFrame:
         """ load the current values from the API """
 
-        df = get_remote_csv("https://covidtracking.com/api/states.csv")
-
-        df = df.fillna(0)
-        df["lastUpdateEt"] = pd.to_datetime(df["lastUpdateEt"].str.replace(" ", "/2020 "), format="%m/%d/%Y %H:%M") \
-            .apply(udatetime.pandas_timestamp_as_eastern)
-        df["checkTimeEt"] = pd.to_datetime(df["checkTimeEt"].str.replace(" ", "/2020 "), format="%m/%d/%Y %H:%M") \
-            .apply(udatetime.pandas_timestamp_as_eastern)
-        df["dateModified"] = pd.to_datetime(df["dateModified"])
-        df["dateChecked"] = pd.to_datetime(df["dateChecked"])
-
-        df.fillna(0.0, inplace=True)
-
-        # counts
-        for c in ["positive", "negative", "pending", "hospitalized", "death", "recovered", "total", "totalTestResults"]:
-            df[c] = df[c].astype(np.int)
-        for c in ['hospitalizedCumulative', 'inIcuCumulative', 'onVentilatorCumulative']:
-            df[c] = df[c].astype(np.int)
-
-        # 0 or 1.  score = sum of others so it is 0-4
-        for c in ["positiveScore", "negativeScore", "negativeRegularScore", "commercialScore", "score"]:
-            df[c] = df[c].astype(np.int)
+        df = get_remote_csv("https://covidtracking.com/api/states.csv",
+            parse=_parse_current, parse_key="typed")
         return df
 
 
     def load_history(self) -> pd.DataFrame:
         """ load daily values over time from the API """
 
-        df = get_remote_csv("https://covidtracking.com/api/states/daily.csv")
-        df.fillna(0.0, inplace=True)
-
-        # counts
-        for c in ["positive", "negative", "pending", "hospitalized", "death", "recovered", "total", "totalTestResults"]:
-            df[c] = df[c].astype(np.int)
-        for c in ["positiveIncrease", "negativeIncrease", "hospitalizedIncrease", "deathIncrease", "totalTestResultsIncrease"]:
-            df[c] = df[c].astype(np.int)
-        for c in ['hospitalizedCumulative', 'inIcuCumulative', 'onVentilatorCumulative']:
-            df[c] = df[c].astype(np.int)
-
-
-        df["dateChecked"] = pd.to_datetime(df["dateChecked"])
+        df = get_remote_csv("https://covidtracking.com/api/states/daily.csv",
+            parse=_parse_history, parse_key="typed")
         return df
 
     def load_cds_counties(self) -> pd.DataFrame:
@@ -520,9 +788,7 @@ class DataSource:
         """ load the CSBS county dataset """
 
         xurl = "http://coronavirus-tracker-api.herokuapp.com/v2/locations?source=csbs"
-        response = urlopen(xurl, timeout=1)
-        json_data = response.read().decode('utf-8', 'replace')
-        d = json.loads(json_data)
+        d = get_remote_json(xurl)
         csbs = pd.json_normalize(d['locations'])
 
         # remove "extras"
@@ -540,14 +806,14 @@ class DataSource:
         return csbs
 
     def load_nyt_counties(self) -> pd.DataFrame:
+        """ load the NYT county dataset (newest date only) """
 
-        df = get_remote_csv("https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-counties.csv")
+        df = get_remote_csv("https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-counties.csv",
+            parse=_parse_nyt_last_date, parse_key="last-date")
 
-        """ load the NYT county dataset """
         nyt = df.rename(columns={
                 "date":"last_updated"
             })
-        nyt = nyt.loc[nyt["last_updated"] == nyt["last_updated"].max()]
         nyt["state"] = nyt["state"].map(state_abbrevs)
         nyt["source"] = "nyt"
         return nyt
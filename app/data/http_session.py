@@ -0,0 +1,41 @@
+#
+# Shared HTTP session for all remote sources
+#
+#   One pooled requests.Session so each refresh cycle reuses TCP/TLS
+#   connections (keep-alive) and asks for compressed responses.
+#
+#   The urllib3 pools behind the session are thread-safe so the
+#   prefetch threads in DataSource can share it.
+#
+
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+POOL_CONNECTIONS = 8   # number of hosts to keep a pool for
+POOL_MAXSIZE = 4       # connections kept open per host
+
+g_session: requests.Session = None
+g_lock = threading.Lock()
+
+def create_session() -> requests.Session:
+    " create a session with keep-alive, per-host connection limits and gzip "
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({
+        "Accept-Encoding": "gzip, deflate",
+        "Connection": "keep-alive",
+    })
+    return session
+
+def get_session() -> requests.Session:
+    " get the shared session, created on first use "
+    global g_session
+    if g_session is None:
+        with g_lock:
+            if g_session is None:
+                g_session = create_session()
+    return g_session
@@ -0,0 +1,205 @@
+#
+# Conditional-GET cache for remote sources
+#
+#   Each URL is stored in a single file: a fixed-size line of json metadata
+#   (ETag, Last-Modified, sha1 of the body) followed by the body itself.
+#   Requests send If-None-Match/If-Modified-Since and reuse the cached
+#   body when the server answers 304.
+#
+#   Parsed results (usually a DataFrame) are kept in memory and pickled
+#   next to the body, keyed by the sha1 of the content they came from,
+#   so an unchanged source skips parsing as well as the download.
+#
+#   The CLI and the Pyro service point at the same cache_dir so they share it.
+#
+
+import os
+import io
+import json
+import pickle
+import hashlib
+import threading
+from typing import Any, Callable, Dict, IO, Tuple
+from loguru import logger
+
+from .http_session import get_session
+
+CHUNK_SIZE = 64 * 1024
+META_SIZE = 1024
+
+
+def _tmp_path(p: str) -> str:
+    " a temp file next to p, unique per process and thread (prefetch fetches on threads) "
+    return f"{p}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+class RemoteCache:
+    " cache remote content on disk (or in memory if there is no cache_dir) "
+
+    def __init__(self, cache_dir: str = None, timeout: float = 1):
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+
+        # url -> (meta, body) when there is no cache_dir
+        self._bodies: Dict[str, tuple] = {}
+        # (url, parse_key) -> (sha1, value)
+        self._parsed: Dict[tuple, tuple] = {}
+
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def _path(self, url: str, ext: str) -> str:
+        h = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{h}.{ext}")
+
+    def _read_meta(self, url: str) -> Dict:
+        if not self.cache_dir:
+            x = self._bodies.get(url)
+            return x[0] if x else None
+
+        p = self._path(url, "body")
+        if not os.path.exists(p): return None
+        try:
+            with open(p, "rb") as f:
+                return json.loads(f.readline())
+        except Exception as ex:
+            logger.warning(f"  ignore bad cache entry {p}: {ex}")
+            return None
+
+    def _open_body(self, url: str) -> Tuple[IO, Dict]:
+        """ return a binary file positioned at the start of the body
+        and the metadata read from that same file
+        """
+        if not self.cache_dir:
+            meta, body = self._bodies[url]
+            return io.BytesIO(body), meta
+
+        f = open(self._path(url, "body"), "rb")
+        meta = json.loads(f.readline())
+        return f, meta
+
+    def fetch(self, url: str) -> Dict:
+        """ make sure the cached body for url is current
+
+        returns the metadata for the body, including its sha1
+        """
+
+        meta = self._read_meta(url)
+
+        headers = {}
+        if meta:
+            if meta.get("etag"): headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"): headers["If-Modified-Since"] = meta["last_modified"]
+
+        with get_session().get(url, headers=headers, timeout=self.timeout, stream=True) as r:
+            if r.status_code == 304 and meta:
+                logger.info(f"  {url} not modified")
+                return meta
+            if r.status_code >= 300:
+                raise Exception(f"Could not get {url}, status={r.status_code}")
+
+            meta = {
+                "url": url,
+                "etag": r.headers.get("ETag"),
+                "last_modified": r.headers.get("Last-Modified"),
+            }
+            h = hashlib.sha1()
+
+            if not self.cache_dir:
+                body = r.content
+                h.update(body)
+                meta["sha1"] = h.hexdigest()
+                self._bodies[url] = (meta, body)
+                return meta
+
+            # stream to a temp file then swap it in so readers
+            # in other processes never see a partial body.  the metadata
+            # line has a fixed size so it can be filled in at the end.
+            p = self._path(url, "body")
+            tmp_path = _tmp_path(p)
+            with open(tmp_path, "wb") as f:
+                f.write(b" " * (META_SIZE - 1) + b"\n")
+                for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                    h.update(chunk)
+                    f.write(chunk)
+                meta["sha1"] = h.hexdigest()
+
+                header = json.dumps(meta).encode("utf-8")
+                if len(header) >= META_SIZE:
+                    raise Exception(f"Cache metadata for {url} is too long")
+                f.seek(0)
+                f.write(header)
+            os.replace(tmp_path, p)
+
+        logger.info(f"  {url} downloaded")
+        return meta
+
+    def load(self, url: str, parse: Callable[[IO], Any], parse_key: str) -> Any:
+        """ get the parsed content of url
+
+        parse is called with a binary file positioned at the body.
+        parse_key names the parser so different parsers of the same url
+        are cached separately.
+
+        the cached value is shared, callers must copy it before changing it.
+        """
+
+        self.fetch(url)
+
+        # the body can be replaced by another process at any time so
+        # take the sha1 from the file that is actually parsed
+        f, meta = self._open_body(url)
+        try:
+            return self._parse(url, f, meta["sha1"], parse, parse_key)
+        finally:
+            f.close()
+
+    def _parse(self, url: str, f: IO, sha1: str, parse: Callable[[IO], Any], parse_key: str) -> Any:
+
+        key = (url, parse_key)
+        x = self._parsed.get(key)
+        if x and x[0] == sha1:
+            return x[1]
+
+        pkl_path = self._path(url, f"{parse_key}.pkl") if self.cache_dir else None
+        if pkl_path and os.path.exists(pkl_path):
+            try:
+                with open(pkl_path, "rb") as fin:
+                    x = pickle.load(fin)
+                if x[0] == sha1:
+                    self._parsed[key] = x
+                    return x[1]
+            except Exception as ex:
+                logger.warning(f"  ignore bad parsed cache entry {pkl_path}: {ex}")
+
+        value = parse(f)
+
+        x = (sha1, value)
+        self._parsed[key] = x
+        if pkl_path:
+            try:
+                tmp_path = _tmp_path(pkl_path)
+                with open(tmp_path, "wb") as fout:
+                    pickle.dump(x, fout, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, pkl_path)
+            except Exception as ex:
+                logger.warning(f"  could not save parsed cache entry {pkl_path}: {ex}")
+        return value
+
+
+g_cache: RemoteCache = None
+
+def init_cache(cache_dir: str) -> RemoteCache:
+    " use a shared on-disk cache for all remote sources "
+    global g_cache
+    if g_cache is None or g_cache.cache_dir != cache_dir:
+        logger.info(f"remote cache at {cache_dir}")
+        g_cache = RemoteCache(cache_dir)
+    return g_cache
+
+def get_cache() -> RemoteCache:
+    " get the remote cache, defaults to an in-memory cache "
+    global g_cache
+    if g_cache is None:
+        g_cache = RemoteCache()
+    return g_cache
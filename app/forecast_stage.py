@@ -0,0 +1,176 @@
+#
+# Forecast Stage -- fit/project/save/plot the forecasts in a process pool
+#
+#   The forecasts for the states that changed are computed before the row
+#   loop in check_dataset.  The row loop then only evaluates the finished
+#   forecasts so the ResultLog is filled in state order, exactly like the
+#   serial path.
+#
+#   Workers capture their log messages and the parent replays them in
+#   state order so the console output does not depend on scheduling.
+#
+#   The pool is long-lived and uses forkserver workers, the service has
+#   threads running so it must not fork itself.
+#
+
+import copy
+import multiprocessing
+from types import SimpleNamespace
+from concurrent.futures import ProcessPoolExecutor, Future
+from threading import Lock
+from typing import Callable, Dict, List, Tuple
+import pandas as pd
+from loguru import logger
+
+import app.checks as checks
+from .qc_config import QCConfig
+from .log.result_log import ResultLog
+from .modeling.forecast import Forecast, register_params, has_params, get_params, set_params
+from .modeling.forecast_store import ForecastStore
+
+# (level, message) captured in a worker for the current job
+g_messages: List[Tuple[str, str]] = []
+
+
+def _capture(message):
+    record = message.record
+    g_messages.append((record["level"].name, record["message"]))
+
+def _init_worker():
+    logger.remove()
+    logger.add(_capture, level="DEBUG", format="{message}")
+
+def _run_job(job: tuple) -> Tuple[Forecast, List[Tuple[str, str]], str]:
+    row, history, context, config, forecast, params = job
+
+    g_messages.clear()
+    set_params(row.state, params)
+    try:
+        forecast = checks.run_forecast(row, history, context, config, forecast)
+        error = None
+    except Exception as ex:
+        forecast, error = None, str(ex)
+    return forecast, list(g_messages), error
+
+
+def changed_states(df: pd.DataFrame, history_for: Callable, config: QCConfig, last_changes: Dict
+        ) -> Dict[object, Tuple[bool, ResultLog]]:
+    """ run increasing_values for each row of df
+
+    returns (has_changed, messages) by row index, the row loop replays the messages
+    (see replay_changes) instead of running the check again.  rows that raise are left
+    out so the row loop reruns and reports them.
+    """
+
+    changes = {}
+    for row in df.itertuples():
+        messages = ResultLog()
+        try:
+            changes[row.Index] = (checks.increasing_values(row, history_for(row.state), messages, config, last_changes), messages)
+        except Exception:
+            pass
+    return changes
+
+
+def replay_changes(row, changes: Dict[object, Tuple[bool, ResultLog]], log: ResultLog) -> bool:
+    " add the increasing_values messages of row to log, returns None if changed_states did not run it "
+    x = changes.get(row.Index) if changes else None
+    if x is None: return None
+
+    has_changed, messages = x
+    for m in messages.messages:
+        log.add(m.category, m.location, m.message, message_id=m.message_id)
+    return has_changed
+
+
+g_pool: ProcessPoolExecutor = None
+g_pool_workers = 0
+# the working and current refresh threads share the pool
+g_pool_lock = Lock()
+
+def _get_pool(n_workers: int) -> ProcessPoolExecutor:
+    " the shared pool, call with g_pool_lock held "
+    global g_pool, g_pool_workers
+    if g_pool is None or g_pool_workers != n_workers:
+        # wait=False lets the jobs already submitted to the old pool finish
+        if g_pool is not None: g_pool.shutdown(wait=False)
+        g_pool = ProcessPoolExecutor(n_workers, mp_context=multiprocessing.get_context("forkserver"),
+            initializer=_init_worker)
+        g_pool_workers = n_workers
+    return g_pool
+
+def get_forecast_pool(n_workers: int) -> ProcessPoolExecutor:
+    " get the shared forecast pool, created on first use "
+    with g_pool_lock:
+        return _get_pool(n_workers)
+
+def submit_jobs(n_workers: int, jobs: List[tuple]) -> List[Future]:
+    " submit the jobs to the shared pool, the pool cannot be replaced in between "
+    with g_pool_lock:
+        pool = _get_pool(n_workers)
+        return [pool.submit(_run_job, job) for job in jobs]
+
+def shutdown_forecast_pool():
+    " stop the forecast workers "
+    global g_pool
+    with g_pool_lock:
+        if g_pool is not None:
+            g_pool.shutdown()
+            g_pool = None
+
+
+def run_forecasts(rows: List, history_for: Callable, context: str, config: QCConfig,
+        fitted: Dict[str, Forecast] = None, store: ForecastStore = None) -> Dict[str, Forecast]:
+    """ run the forecasts for rows in a process pool
+
+    fitted has the already fitted models (from forecast_batch), they are only sent to the pool
+    if the workers plot them, otherwise the row loop projects them.
+    finished forecasts are added to store (the workers do not have it).
+
+    returns the finished forecasts keyed by state, states that failed are left out
+    so the row loop reruns them and reports the error.
+    """
+
+    # plots go to the render queue from here, not from the workers
+    render = config.plot_models and not config.save_results and config.plot_mode != "batch" \
+        and config.render_workers > 0
+    job_config = config
+    if render:
+        job_config = copy.copy(config)
+        job_config.plot_models = False
+
+    # a fitted forecast only needs project(), that is cheaper in the row loop than pickling it
+    plot_in_workers = job_config.plot_models and not config.save_results and config.plot_mode != "batch"
+    if not plot_in_workers and fitted:
+        rows = [row for row in rows if row.state not in fitted]
+
+    jobs = []
+    for row in rows:
+        # the workers do not share g_exp_params, send the warm start with the job
+        if store is not None and not has_params(row.state):
+            register_params(store.find_last(row.state, row.targetDate))
+
+        # itertuples rows do not pickle, keep what the forecast needs
+        x = SimpleNamespace(state=row.state, targetDate=row.targetDate, positive=row.positive)
+        jobs.append((x, history_for(row.state), context, job_config,
+            fitted.get(row.state) if fitted else None, get_params(row.state)))
+    if len(jobs) == 0:
+        return {}
+
+    logger.info(f"  run {len(jobs)} forecasts on {config.forecast_workers} workers")
+    results = [f.result() for f in submit_jobs(config.forecast_workers, jobs)]
+
+    forecasts = {}
+    for (x, _, _, _, _, _), (forecast, messages, error) in zip(jobs, results):
+        for level, message in messages:
+            logger.log(level, message)
+        if error is not None:
+            logger.warning(f"  {x.state}: forecast failed in worker: {error}")
+            continue
+        register_params(forecast)
+        if store is not None:
+            store.add(forecast)
+        if render:
+            checks.plot_forecast(forecast, f"{config.images_dir}/{context}", config)
+        forecasts[x.state] = forecast
+    return forecasts
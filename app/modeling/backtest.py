@@ -0,0 +1,244 @@
+#
+# Backtest -- replay expected_positive_increase over the whole history
+#
+#   Every (state, date) in the history is forecast from the days before it,
+#   the same way the checks do it, with all the windows fitted together by
+#   forecast_batch.  The history is assumed to be correct so every flagged
+#   value counts as a false positive.
+#
+#   The false-positive rates of candidate FIT_THRESHOLDS are found with a
+#   grid search in a process pool, and the rates of candidate
+#   IGNORE_THRESHOLDS values from the day-over-day repeats in the history.
+#
+#   run from the repo root:  python -m app.modeling.backtest
+#
+
+import sys
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+import pandas as pd
+import numpy as np
+from loguru import logger
+
+from .forecast_batch import LINEAR_DAYS, fit_linear_batch, fit_exp_batch
+
+# need a few days before the first forecast
+MIN_DAYS = 5
+
+# same limits as expected_positive_increase
+MIN_ACTUAL = 300
+MAX_EXPECTED = 100_000
+
+FIT_LOW_GRID = np.round(np.arange(0.50, 1.00, 0.05), 2)
+FIT_HIGH_GRID = np.round(np.arange(1.05, 2.05, 0.05), 2)
+IGNORE_GRID = [0, 10, 20, 50, 100, 200, 500, 900, 1000, 2000]
+
+
+def _days_between(d1: np.ndarray, d2: np.ndarray) -> np.ndarray:
+    " days from YYYYmmdd d1 to YYYYmmdd d2 "
+    t1 = pd.to_datetime(d1.astype(str), format="%Y%m%d")
+    t2 = pd.to_datetime(d2.astype(str), format="%Y%m%d")
+    return (t2 - t1).days.values
+
+
+def build_windows(history: pd.DataFrame, min_days: int = MIN_DAYS, max_days: int = None
+        ) -> Tuple[pd.DataFrame, np.ndarray, np.ndarray]:
+    """ one row per (state, date) with the positives of the days before it
+
+    max_days limits the window (rolling), None uses all the earlier days (like the checks).
+    returns the (state, date, actual, prev, prev_date) frame and the padded y/mask arrays
+    """
+
+    df = history[["state", "date", "positive"]].copy()
+    df["state"] = df["state"].astype(str)
+    df = df.sort_values(["state", "date"], kind="mergesort")
+
+    metas, ys, masks = [], [], []
+    width = 0
+    for state, state_df in df.groupby("state", sort=True):
+        values = state_df["positive"].values.astype(float)
+        dates = state_df["date"].values
+        n = len(values)
+        if n <= min_days: continue
+
+        ends = np.arange(min_days, n)
+        starts = np.zeros_like(ends) if max_days is None else np.maximum(ends - max_days, 0)
+        lengths = ends - starts
+        w = lengths.max()
+
+        # window k holds values[starts[k]:ends[k]], left aligned
+        cols = starts[:, None] + np.arange(w)[None, :]
+        mask = cols < ends[:, None]
+        y = np.where(mask, values[np.minimum(cols, n - 1)], 0.0)
+
+        metas.append(pd.DataFrame({
+            "state": state,
+            "date": dates[ends],
+            "actual": values[ends],
+            "prev": values[ends - 1],
+            "prev_date": dates[ends - 1],
+            "n_days": lengths,
+        }))
+        ys.append(y)
+        masks.append(mask)
+        width = max(width, w)
+
+    if len(metas) == 0:
+        return pd.DataFrame(), np.zeros((0, 0)), np.zeros((0, 0), dtype=bool)
+
+    pad = lambda a, fill: np.pad(a, ((0, 0), (0, width - a.shape[1])), constant_values=fill)
+    meta = pd.concat(metas, ignore_index=True)
+    y = np.concatenate([pad(a, 0.0) for a in ys])
+    mask = np.concatenate([pad(a, False) for a in masks])
+    return meta, y, mask
+
+
+def forecast_windows(meta: pd.DataFrame, y: np.ndarray, mask: np.ndarray) -> pd.DataFrame:
+    " fit all the windows and add expected_linear/expected_exp to meta "
+
+    x = np.broadcast_to(np.arange(y.shape[1], dtype=float), y.shape)
+    n = mask.sum(axis=1)
+    mask_linear = mask & (x >= (n - LINEAR_DAYS)[:, None])
+
+    m, b = fit_linear_batch(x, y, mask_linear).T
+    a, k = fit_exp_batch(x, y, mask).T
+
+    # same projection as Forecast.project
+    p = (n - 1) + _days_between(meta["prev_date"].values, meta["date"].values)
+    with np.errstate(over="ignore", invalid="ignore"):
+        expected_linear = np.round(m * p + b)
+        expected_exp = np.round(a * np.exp(k * p))
+
+    meta = meta.copy()
+    meta["expected_linear"] = expected_linear
+    meta["expected_exp"] = expected_exp
+    return meta
+
+
+def evaluated_rows(meta: pd.DataFrame) -> np.ndarray:
+    " rows where expected_positive_increase gets past its sanity checks "
+    actual, linear, exp = meta["actual"].values, meta["expected_linear"].values, meta["expected_exp"].values
+    with np.errstate(invalid="ignore"):
+        return np.isfinite(linear) & np.isfinite(exp) \
+            & (actual != meta["prev"].values) \
+            & (actual >= MIN_ACTUAL) \
+            & (linear <= MAX_EXPECTED) \
+            & (linear < exp)
+
+
+def fit_flags(actual: np.ndarray, linear: np.ndarray, exp: np.ndarray, low: float, high: float) -> np.ndarray:
+    " vectorized version of the range test in expected_positive_increase "
+
+    min_value = np.trunc(low * linear)
+    max_value = np.trunc(high * exp)
+    outside = (actual < min_value) | (actual > max_value)
+
+    # linear steeper than exp -> compare against the linear band
+    high_linear = np.trunc(high * linear)
+    low_linear = np.trunc(linear - (high_linear - linear))
+    outside_linear = (actual < low_linear) | (actual > high_linear)
+
+    return np.where(outside, True, (min_value >= max_value) & outside_linear)
+
+
+def _grid_chunk(args: tuple) -> List[Tuple[float, float, int]]:
+    actual, linear, exp, pairs = args
+    return [(low, high, int(fit_flags(actual, linear, exp, low, high).sum())) for low, high in pairs]
+
+
+def fit_threshold_grid(meta: pd.DataFrame, lows=FIT_LOW_GRID, highs=FIT_HIGH_GRID, workers: int = 4) -> pd.DataFrame:
+    " false-positive rate for each (low, high) pair, sorted best first "
+
+    ok = evaluated_rows(meta)
+    actual = meta["actual"].values[ok]
+    linear = meta["expected_linear"].values[ok]
+    exp = meta["expected_exp"].values[ok]
+
+    pairs = [(float(low), float(high)) for low in lows for high in highs]
+    n_chunks = max(1, workers)
+    chunks = [(actual, linear, exp, pairs[i::n_chunks]) for i in range(n_chunks)]
+
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            results = [x for chunk in pool.map(_grid_chunk, chunks) for x in chunk]
+    else:
+        results = [x for chunk in map(_grid_chunk, chunks) for x in chunk]
+
+    df = pd.DataFrame(results, columns=["low", "high", "flagged"])
+    df["evaluated"] = len(actual)
+    df["fp_rate"] = df["flagged"] / max(len(actual), 1)
+    return df.sort_values(["fp_rate", "low", "high"], ascending=[True, False, True]).reset_index(drop=True)
+
+
+def ignore_threshold_rates(history: pd.DataFrame, thresholds: List[int] = IGNORE_GRID,
+        metrics: List[str] = None) -> pd.DataFrame:
+    """ rate of "hasn't changed" messages for each candidate IGNORE_THRESHOLDS value
+
+    a value is reported as unchanged when it equals the day before and is >= the threshold
+    """
+
+    if metrics is None:
+        from app.checks import IGNORE_THRESHOLDS
+        metrics = list(IGNORE_THRESHOLDS)
+
+    df = history.copy()
+    df["state"] = df["state"].astype(str)
+    df = df.sort_values(["state", "date"], kind="mergesort")
+
+    rows = []
+    for c in metrics:
+        if c not in df.columns: continue
+        value = df[c].values.astype(float)
+        prev = df.groupby("state", sort=False)[c].shift(1).values.astype(float)
+        has_prev = ~np.isnan(prev)
+        same = has_prev & (value == prev)
+        for t in thresholds:
+            flagged = int((same & (value >= t)).sum())
+            rows.append({"metric": c, "threshold": t, "flagged": flagged,
+                "evaluated": int(has_prev.sum()), "fp_rate": flagged / max(int(has_prev.sum()), 1)})
+    return pd.DataFrame(rows)
+
+
+def backtest(history: pd.DataFrame, max_days: int = None, workers: int = 4) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    " returns the forecast for every (state, date), the FIT_THRESHOLDS grid and the IGNORE_THRESHOLDS rates "
+
+    meta, y, mask = build_windows(history, max_days=max_days)
+    meta = forecast_windows(meta, y, mask)
+    return meta, fit_threshold_grid(meta, workers=workers), ignore_threshold_rates(history)
+
+
+def main():
+
+    parser = ArgumentParser(description="backtest FIT_THRESHOLDS and IGNORE_THRESHOLDS against the history")
+    parser.add_argument('--max_days', type=int, default=None, help='rolling window size (default: all earlier days)')
+    parser.add_argument('--workers', type=int, default=4, help='processes for the grid search')
+    parser.add_argument('--top', type=int, default=10, help='number of threshold pairs to show')
+    args = parser.parse_args(sys.argv[1:])
+
+    from app.data.data_source import DataSource
+    from app.checks import FIT_THRESHOLDS, IGNORE_THRESHOLDS
+
+    ds = DataSource()
+    if ds.history is None:
+        ds.log.print()
+        sys.exit(1)
+
+    t = time.perf_counter()
+    meta, grid, ignore = backtest(ds.history, args.max_days, args.workers)
+    logger.info(f"backtest of {len(meta):,} forecasts in {time.perf_counter() - t:.1f}s")
+
+    current = grid[(grid["low"] == FIT_THRESHOLDS[0]) & (grid["high"] == FIT_THRESHOLDS[1])]
+    if not current.empty:
+        logger.info(f"FIT_THRESHOLDS {FIT_THRESHOLDS}: false-positive rate {current['fp_rate'].values[0]:.1%}")
+    logger.info(f"best FIT_THRESHOLDS:\n{grid.head(args.top)}")
+
+    for c, t in IGNORE_THRESHOLDS.items():
+        x = ignore[(ignore["metric"] == c) & (ignore["threshold"] == t)]
+        if not x.empty:
+            logger.info(f"IGNORE_THRESHOLDS[{c}] = {t}: false-positive rate {x['fp_rate'].values[0]:.1%}")
+    logger.info(f"IGNORE_THRESHOLDS candidates:\n{ignore}")
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,14 @@
 # Forecast -- a simple model of how many cases are excepted given recent data
 #
 import os
+import time
 from datetime import datetime
 import pandas as pd
 import numpy as np
-from scipy.optimize import curve_fit
-from typing import Tuple
+from typing import Dict, Tuple
+from loguru import logger
+
+from .forecast_cache import ForecastCache, forecast_key
 
 
 def _exp_fit(x: float, a: float, b: float) -> float:
@@ -15,15 +18,60 @@ def _exp_fit(x: float, a: float, b: float) -> float:
 def _linear_fit(x: float, m: float, b: float) -> float:
     return m*x + b
 
-def _get_distribution_fit(x: pd.Series, y: pd.Series, dist_func) -> np.array:
+def _logistic_fit(x: float, k: float, r: float, x0: float) -> float:
+    " k is the ceiling, r the growth rate and x0 the midpoint "
+    return k / (1 + np.exp(np.clip(-r * (x - x0), -50, 50)))
+
+DEFAULT_P0 = (4, 0.1)
+
+def _get_distribution_fit(x: pd.Series, y: pd.Series, dist_func, p0: tuple = DEFAULT_P0) -> Tuple[np.array, int]:
+    " fit dist_func starting at p0, returns the parameters and the number of function evaluations "
+
+    # scipy is slow to import, only load it when a fit is needed
+    from scipy.optimize import curve_fit
 
     np.random.seed(1729)
 
     x = np.array(x.values, dtype=float)
     y = np.array(y.values, dtype=float)
 
-    popt, pcov = curve_fit(dist_func, x, y, p0=(4, 0.1))
-    return popt
+    nfev = 0
+    def counted_func(*args):
+        nonlocal nfev
+        nfev += 1
+        return dist_func(*args)
+
+    popt, pcov = curve_fit(counted_func, x, y, p0=p0)
+    return popt, nfev
+
+
+# state -> last fitted exp params, used as the starting point of the next fit
+g_exp_params: Dict[str, np.ndarray] = {}
+
+def register_params(forecast: "Forecast"):
+    " remember the exp params of a fitted (or loaded) forecast to warm-start the next fit "
+    if forecast is None or forecast.fitted_exp_params is None: return
+    p = np.asarray(forecast.fitted_exp_params, dtype=float)
+    if np.all(np.isfinite(p)):
+        g_exp_params[str(forecast.state)] = p
+
+def has_params(state: str) -> bool:
+    return str(state) in g_exp_params
+
+def get_params(state: str) -> np.ndarray:
+    " the warm-start params of a state, None if there are none "
+    return g_exp_params.get(str(state))
+
+def set_params(state: str, p: np.ndarray):
+    " set the warm-start params of a state (in a worker process) "
+    if p is not None:
+        g_exp_params[str(state)] = p
+
+
+def finite_or_none(p: np.ndarray) -> np.ndarray:
+    " the params of a successful fit, None for a failed (NaN) or missing one "
+    if p is None or not np.all(np.isfinite(p)): return None
+    return p
 
 
 class Forecast():
@@ -38,12 +86,16 @@ class Forecast():
         self.actual_value = 0
         self.expected_exp = 0
         self.expected_linear = 0
+        self.expected_logistic = 0
 
         self.cases_df: pd.DataFrame = None
         self.projection_index = None
         self.fitted_linear_params = None
         self.fitted_exp_params = None
+        self.fitted_logistic_params = None
 
+        # nfev/seconds per model and if the exp fit was warm-started, None if not fitted here
+        self.fit_stats: Dict = None
 
 
     @property
@@ -52,8 +104,11 @@ class Forecast():
         return self.actual_value, self.expected_linear, self.expected_exp
 
 
-    def fit(self, df: pd.DataFrame):
-        "Fit an exponential and linear model to the history"
+    def fit(self, df: pd.DataFrame, cache: ForecastCache = None, logistic: bool = False):
+        """Fit an exponential and linear model to the history, reuse the cached fit if there is one
+
+        logistic also fits the logistic model (only needed for upper_model = logistic)
+        """
 
         self.df = df
         self.state = df["state"].values[0]
@@ -64,11 +119,70 @@ class Forecast():
             .rename_axis('index') \
             .reset_index()
 
+        key = forecast_key(self.cases_df, self.date) if cache else None
+        if cache:
+            params = cache.get(key)
+            if params is not None:
+                self.fitted_linear_params, self.fitted_exp_params, logistic_params = params
+                self.fitted_logistic_params = finite_or_none(logistic_params)
+                register_params(self)
+                # None = not fitted yet, NaN = the fit failed, do not try again
+                if logistic and logistic_params is None:
+                    cache.put(key, self.fitted_linear_params, self.fitted_exp_params, self._fit_logistic())
+                return
+
         to_fit_exp = self.cases_df
         to_fit_linear = self.cases_df[-4:]
 
-        self.fitted_linear_params = _get_distribution_fit(to_fit_linear["index"], to_fit_linear["positive"], _linear_fit)
-        self.fitted_exp_params = _get_distribution_fit(to_fit_exp["index"], to_fit_exp["positive"], _exp_fit)
+        stats = {}
+
+        t = time.perf_counter()
+        self.fitted_linear_params, stats["linear_nfev"] = \
+            _get_distribution_fit(to_fit_linear["index"], to_fit_linear["positive"], _linear_fit)
+        stats["linear_seconds"] = time.perf_counter() - t
+
+        # start from the last params for the state, the index origin
+        # (first day of history) does not move so they stay close
+        t = time.perf_counter()
+        p0 = g_exp_params.get(str(self.state))
+        stats["warm_start"] = p0 is not None
+        try:
+            self.fitted_exp_params, stats["exp_nfev"] = \
+                _get_distribution_fit(to_fit_exp["index"], to_fit_exp["positive"], _exp_fit,
+                    tuple(p0) if p0 is not None else DEFAULT_P0)
+        except RuntimeError as ex:
+            if p0 is None: raise
+            logger.warning(f"  {self.state}: warm-started fit failed ({ex}), retry from {DEFAULT_P0}")
+            stats["warm_start"] = False
+            self.fitted_exp_params, stats["exp_nfev"] = \
+                _get_distribution_fit(to_fit_exp["index"], to_fit_exp["positive"], _exp_fit)
+        stats["exp_seconds"] = time.perf_counter() - t
+
+        logistic_params = None
+        if logistic:
+            t = time.perf_counter()
+            logistic_params = self._fit_logistic()
+            stats["logistic_seconds"] = time.perf_counter() - t
+
+        self.fit_stats = stats
+        register_params(self)
+
+        if cache:
+            # a failed logistic fit is cached (as NaN) so it is not refitted every run
+            cache.put(key, self.fitted_linear_params, self.fitted_exp_params, logistic_params)
+
+    def _fit_logistic(self) -> np.ndarray:
+        """ no curve_fit for the logistic, it uses the batch solver on one row
+
+        returns the params, NaN if the fit failed (fitted_logistic_params is None then)
+        """
+        from .forecast_batch import fit_logistic_batch
+
+        x = self.cases_df["index"].values.astype(float)[None, :]
+        y = self.cases_df["positive"].values.astype(float)[None, :]
+        p = fit_logistic_batch(x, y, np.ones(y.shape, dtype=bool), np.asarray(self.fitted_exp_params)[None, :])[0]
+        self.fitted_logistic_params = finite_or_none(p)
+        return p
 
     def project(self, row: tuple) -> None:
         "Get forecasted positives value for current day"
@@ -81,4 +195,12 @@ class Forecast():
         self.projection_index = self.cases_df["index"].max() + days_forward
         self.expected_exp = _exp_fit(self.projection_index, *self.fitted_exp_params).round().astype(int)
         self.expected_linear = _linear_fit(self.projection_index, *self.fitted_linear_params).round().astype(int)
+        if self.fitted_logistic_params is not None:
+            self.expected_logistic = _logistic_fit(self.projection_index, *self.fitted_logistic_params).round().astype(int)
+
+    def expected_upper(self, model: str) -> int:
+        " the upper bound for model (exp or logistic), exp if there is no logistic fit "
+        if model == "logistic" and self.fitted_logistic_params is not None:
+            return self.expected_logistic
+        return self.expected_exp
 
@@ -0,0 +1,239 @@
+#
+# Batch Forecast -- fit the Forecast models for all states at once
+#
+#   The linear model (last 4 days) is fitted with closed-form least squares.
+#   The exponential model starts from a log-linear solve and is refined with
+#   a few Levenberg-Marquardt steps on the same least-squares objective that
+#   curve_fit uses.  All states are fitted together as padded NumPy arrays.
+#
+#   The logistic model uses the same Levenberg-Marquardt solver, starting
+#   from the exponential fit.
+#
+#   States that do not produce finite parameters fall back to Forecast.fit.
+#   States with a cached fit (see forecast_cache.py) are skipped.
+#
+
+from typing import Callable, Dict, Tuple
+import pandas as pd
+import numpy as np
+from loguru import logger
+
+from .forecast import Forecast, register_params, finite_or_none, _logistic_fit
+from .forecast_cache import ForecastCache, forecast_key
+
+LINEAR_DAYS = 4
+LM_ITERATIONS = 20
+
+
+def _pad(codes: np.ndarray, index: np.ndarray, values: np.ndarray, n_states: int) -> Tuple[np.ndarray, np.ndarray]:
+    " scatter values into a (n_states, max_len) array, returns the array and a mask of valid cells "
+
+    n_cols = int(index.max()) + 1 if index.size > 0 else 0
+    y = np.zeros((n_states, n_cols), dtype=float)
+    mask = np.zeros((n_states, n_cols), dtype=bool)
+    y[codes, index] = values
+    mask[codes, index] = True
+    return y, mask
+
+
+def fit_linear_batch(x: np.ndarray, y: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """ closed-form least squares for y = m*x + b on each row
+
+    returns an (n_states, 2) array of (m, b)
+    """
+
+    w = mask.astype(float)
+    n = w.sum(axis=1)
+    sx = (w * x).sum(axis=1)
+    sy = (w * y).sum(axis=1)
+    sxx = (w * x * x).sum(axis=1)
+    sxy = (w * x * y).sum(axis=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        m = (n * sxy - sx * sy) / (n * sxx - sx * sx)
+        b = (sy - m * sx) / n
+    return np.stack([m, b], axis=1)
+
+
+def _exp_model(x: np.ndarray, p: np.ndarray) -> np.ndarray:
+    return p[:, 0:1] * np.exp(p[:, 1:2] * x)
+
+def _exp_jacobian(x: np.ndarray, p: np.ndarray) -> np.ndarray:
+    e = np.exp(p[:, 1:2] * x)
+    return np.stack([e, p[:, 0:1] * x * e], axis=2)
+
+
+def levenberg_marquardt_batch(model: Callable, jacobian: Callable,
+        x: np.ndarray, y: np.ndarray, mask: np.ndarray, p: np.ndarray,
+        n_iter: int = LM_ITERATIONS) -> Tuple[np.ndarray, np.ndarray]:
+    """ minimize sum((y - model(x, p))^2) over the masked cells of each row
+
+    p is (n_states, n_params), returns the fitted p and the SSE per row
+    """
+
+    w = mask.astype(float)
+    lam = np.full(p.shape[0], 1e-3)
+
+    with np.errstate(over="ignore", invalid="ignore"):
+        r = (y - model(x, p)) * w
+        sse = (r * r).sum(axis=1)
+
+        for _ in range(n_iter):
+            J = jacobian(x, p) * w[:, :, None]
+            JTJ = np.einsum("snp,snq->spq", J, J)
+            JTr = np.einsum("snp,sn->sp", J, r)
+
+            # Marquardt scaling of the diagonal
+            A = JTJ + lam[:, None, None] * (JTJ * np.eye(p.shape[1]))
+            A[~np.isfinite(A)] = 0.0
+            delta = np.einsum("spq,sq->sp", np.linalg.pinv(A), JTr)
+
+            p_new = p + delta
+            r_new = (y - model(x, p_new)) * w
+            sse_new = (r_new * r_new).sum(axis=1)
+
+            better = np.isfinite(sse_new) & (sse_new < sse)
+            p = np.where(better[:, None], p_new, p)
+            r = np.where(better[:, None], r_new, r)
+            sse = np.where(better, sse_new, sse)
+            lam = np.where(better, lam / 10.0, lam * 10.0)
+
+    return p, sse
+
+
+def fit_exp_batch(x: np.ndarray, y: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """ fit y = a * exp(b*x) on each row
+
+    returns an (n_states, 2) array of (a, b)
+    """
+
+    # log-linear solve on the positive values for the starting point
+    is_pos = mask & (y > 0)
+    with np.errstate(divide="ignore"):
+        log_y = np.where(is_pos, np.log(np.where(is_pos, y, 1.0)), 0.0)
+    b, log_a = fit_linear_batch(x, log_y, is_pos).T
+    p0 = np.stack([np.exp(log_a), b], axis=1)
+
+    p, _ = levenberg_marquardt_batch(_exp_model, _exp_jacobian, x, y, mask, p0)
+    return p
+
+
+def _fit_params(df: pd.DataFrame, logistic: bool = False) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ fit the linear, exp and (if logistic) logistic models for all states in df (sorted by state, date)
+
+    returns (n_states, n_params) arrays in the order the states first appear,
+    the logistic params are NaN if it is not fitted
+    """
+
+    codes, _ = pd.factorize(df["state"])
+    n_states = codes.max() + 1 if codes.size > 0 else 0
+
+    y, mask = _pad(codes, df["index"].values, df["positive"].values.astype(float), n_states)
+    x = np.broadcast_to(np.arange(y.shape[1], dtype=float), y.shape)
+
+    n = mask.sum(axis=1)
+    mask_linear = mask & (x >= (n - LINEAR_DAYS)[:, None])
+
+    exp_params = fit_exp_batch(x, y, mask)
+    if logistic:
+        logistic_params = fit_logistic_batch(x, y, mask, exp_params)
+    else:
+        logistic_params = np.full((n_states, 3), np.nan)
+    return fit_linear_batch(x, y, mask_linear), exp_params, logistic_params
+
+
+def _logistic_model(x: np.ndarray, p: np.ndarray) -> np.ndarray:
+    return _logistic_fit(x, p[:, 0:1], p[:, 1:2], p[:, 2:3])
+
+def _logistic_jacobian(x: np.ndarray, p: np.ndarray) -> np.ndarray:
+    k, r, x0 = p[:, 0:1], p[:, 1:2], p[:, 2:3]
+    e = np.exp(np.clip(-r * (x - x0), -50, 50))
+    s = 1 / (1 + e)
+    d = k * s * s * e
+    return np.stack([s, d * (x - x0), -d * r], axis=2)
+
+
+def fit_logistic_batch(x: np.ndarray, y: np.ndarray, mask: np.ndarray, exp_params: np.ndarray) -> np.ndarray:
+    """ fit y = k / (1 + exp(-r*(x - x0))) on each row
+
+    starts with the midpoint at the last day (so k is twice the last value)
+    and the growth rate of the exp fit.  returns an (n_states, 3) array of (k, r, x0)
+    """
+
+    n = mask.sum(axis=1)
+    y_max = np.where(mask, y, 0.0).max(axis=1) if y.shape[1] > 0 else np.zeros(y.shape[0])
+    b = exp_params[:, 1]
+    r0 = np.where(np.isfinite(b) & (b > 0), b, 0.1)
+    p0 = np.stack([2 * y_max, r0, (n - 1).astype(float)], axis=1)
+
+    p, _ = levenberg_marquardt_batch(_logistic_model, _logistic_jacobian, x, y, mask, p0)
+    return p
+
+
+def fit_forecasts(history: pd.DataFrame, target_date: int, cache: ForecastCache = None,
+        logistic: bool = False) -> Dict[str, Forecast]:
+    """ fit a Forecast for every state in history
+
+    history is the full history (all states).  Returns fitted (not projected)
+    forecasts keyed by state, call Forecast.project to get the results.
+
+    logistic also fits the logistic model (only needed for upper_model = logistic).
+    states with a cached fit are not refitted.
+    """
+
+    df = history.loc[history["date"] != target_date]
+    df = df.assign(state=df["state"].astype(str)) \
+        .sort_values(["state", "date"], ascending=True, kind="mergesort")
+    df["index"] = df.groupby("state", sort=False).cumcount().values
+
+    groups = list(df.groupby("state", sort=False))
+    if len(groups) == 0: return {}
+
+    params = {}
+    keys = {}
+    if cache:
+        for state, state_df in groups:
+            keys[state] = forecast_key(state_df, target_date)
+            x = cache.get(keys[state])
+            # an entry from an exp-only run does not have the logistic (a failed fit is NaN)
+            if x is not None and (x[2] is not None or not logistic): params[state] = x
+
+    to_fit = [state for state, _ in groups if state not in params]
+    if len(to_fit) > 0:
+        linear_params, exp_params, logistic_params = _fit_params(df.loc[df["state"].isin(to_fit)], logistic)
+        # states come out in the same order as the groups
+        for i, state in enumerate(to_fit):
+            # NaN marks a failed logistic fit, it is cached so it is not refitted every run
+            params[state] = (linear_params[i], exp_params[i], logistic_params[i] if logistic else None)
+
+    forecasts = {}
+    for state, state_df in groups:
+        forecast = Forecast()
+        forecast.date = target_date
+
+        lp, ep, lg = params[state]
+        if np.all(np.isfinite(lp)) and np.all(np.isfinite(ep)):
+            forecast.df = state_df.drop(columns=["index"])
+            forecast.state = state
+            # same layout as Forecast.fit: index column first
+            columns = ["index"] + [c for c in state_df.columns if c != "index"]
+            forecast.cases_df = state_df[columns].reset_index(drop=True)
+            forecast.fitted_linear_params = lp
+            forecast.fitted_exp_params = ep
+            forecast.fitted_logistic_params = finite_or_none(lg)
+            register_params(forecast)
+            if cache and state in to_fit:
+                cache.put(keys[state], lp, ep, lg)
+        else:
+            logger.warning(f"  {state}: batch fit failed, fall back to curve_fit")
+            try:
+                forecast.fit(state_df.drop(columns=["index"]), cache, logistic)
+            except Exception as ex:
+                logger.warning(f"  {state}: could not fit forecast: {ex}")
+                continue
+
+        forecasts[state] = forecast
+
+    if cache:
+        logger.info(f"  forecasts: {len(groups) - len(to_fit)} cached, {len(to_fit)} fitted")
+    return forecasts
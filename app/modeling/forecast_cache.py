@@ -0,0 +1,128 @@
+#
+# Forecast Cache -- reuse fitted parameters while the history is unchanged
+#
+#   The key is a sha1 of the (date, positive) history that goes into
+#   Forecast.fit plus the target date.  The value is the fitted linear,
+#   exponential and logistic parameters, kept in an LRU in memory and
+#   optionally as .npz files on disk so the CLI and the service can share them.
+#
+#   A hit skips the fit entirely, the caller only has to project.
+#
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from threading import Lock
+from typing import Tuple
+import pandas as pd
+import numpy as np
+from loguru import logger
+
+DEFAULT_SIZE = 256
+
+# (linear, exp, logistic), logistic can be None
+FitParams = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+# bump when the cached models change
+CACHE_VERSION = 2
+
+
+def forecast_key(cases_df: pd.DataFrame, date: int) -> str:
+    " hash of the history (sorted by date) that goes into the fit "
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(cases_df["date"].values, dtype=np.int64).tobytes())
+    h.update(np.ascontiguousarray(cases_df["positive"].values, dtype=np.float64).tobytes())
+    h.update(f"{date}|{CACHE_VERSION}".encode("utf-8"))
+    return h.hexdigest()
+
+
+class ForecastCache:
+    " LRU of fitted forecast parameters "
+
+    def __init__(self, max_size: int = DEFAULT_SIZE, cache_dir: str = None):
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = Lock()
+
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def _remember(self, key: str, params: FitParams):
+        with self._lock:
+            self._entries[key] = params
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get(self, key: str) -> FitParams:
+        " get the (linear, exp, logistic) parameters for key, None if they are not cached "
+        if self.max_size <= 0: return None
+
+        with self._lock:
+            params = self._entries.get(key)
+            if params is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return params
+
+        if self.cache_dir:
+            p = self._path(key)
+            if os.path.exists(p):
+                try:
+                    with np.load(p) as x:
+                        params = (x["linear"], x["exp"], x["logistic"] if "logistic" in x.files else None)
+                    self._remember(key, params)
+                    self.hits += 1
+                    return params
+                except Exception as ex:
+                    logger.warning(f"  ignore bad forecast cache entry {p}: {ex}")
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, linear_params: np.ndarray, exp_params: np.ndarray, logistic_params: np.ndarray = None):
+        " save the fitted parameters for key "
+        if self.max_size <= 0: return
+
+        params = (np.asarray(linear_params, dtype=float), np.asarray(exp_params, dtype=float),
+            np.asarray(logistic_params, dtype=float) if logistic_params is not None else None)
+        self._remember(key, params)
+
+        if self.cache_dir:
+            p = self._path(key)
+            tmp_path = f"{p}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                arrays = {"linear": params[0], "exp": params[1]}
+                if params[2] is not None: arrays["logistic"] = params[2]
+                with open(tmp_path, "wb") as f:
+                    np.savez(f, **arrays)
+                os.replace(tmp_path, p)
+            except Exception as ex:
+                logger.warning(f"  could not save forecast cache entry {p}: {ex}")
+
+
+g_forecast_cache: ForecastCache = None
+
+def init_forecast_cache(max_size: int, cache_dir: str = None) -> ForecastCache:
+    " set the size and location of the forecast cache, a size of 0 disables it "
+    global g_forecast_cache
+    if g_forecast_cache is None \
+            or g_forecast_cache.max_size != max_size or g_forecast_cache.cache_dir != cache_dir:
+        logger.info(f"forecast cache size={max_size} at {cache_dir}")
+        g_forecast_cache = ForecastCache(max_size, cache_dir)
+    return g_forecast_cache
+
+def get_forecast_cache() -> ForecastCache:
+    " get the forecast cache, defaults to an in-memory cache "
+    global g_forecast_cache
+    if g_forecast_cache is None:
+        g_forecast_cache = ForecastCache()
+    return g_forecast_cache
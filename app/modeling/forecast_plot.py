@@ -16,7 +16,7 @@ from loguru import logger
 import matplotlib
 import matplotlib.pyplot as plt
 
-from .forecast import Forecast, _exp_fit, _linear_fit
+from .forecast import Forecast, _exp_fit, _linear_fit, _logistic_fit
 
 g_first_time = True
 matplotlib.style.use('fivethirtyeight')
@@ -26,7 +26,11 @@ def _format_date(date:int) -> str:
     str_date = str(date)
     return f"{date[:4]}-{date[4:6]}-{date[6:]}"
 
-def plot_to_file(forecast: Forecast, image_dir: str, fit_thresholds: list):
+def plot_to_file(forecast: Forecast, image_dir: str, fit_thresholds: list, fig=None):
+    """ plot the forecast to {image_dir}/predicted_positives_{state}_{date}.png
+
+    fig is reused (cleared) if it is passed in, otherwise a figure is created and closed here.
+    """
 
     global g_first_time
     if g_first_time:
@@ -41,38 +45,130 @@ def plot_to_file(forecast: Forecast, image_dir: str, fit_thresholds: list):
     exp_fit = _exp_fit(to_plot["index"], *forecast.fitted_exp_params)
     linear_fit = _linear_fit(to_plot["index"], *forecast.fitted_linear_params)
 
+    # the bar plot used to open its own (default size) figure, keep that size
+    own_fig = fig is None
+    if own_fig:
+        fig = plt.figure()
+    else:
+        fig.clf()
 
+    try:
+        ax = fig.add_subplot(111)
 
-    plt.figure(figsize=(9,15))
+        to_plot.plot.bar(x="index", y="positive", color="gray", alpha=.7, label="actual positives growth", ax=ax)
+        ax.plot(to_plot["index"], linear_fit, color="black", label="projected growth")
+        ax.plot(to_plot["index"], exp_fit, color="red", label="exponential fit")
+        if forecast.fitted_logistic_params is not None:
+            ax.plot(to_plot["index"], _logistic_fit(to_plot["index"], *forecast.fitted_logistic_params),
+                color="blue", label="logistic fit")
 
-    ax = to_plot.plot.bar(x="index", y="positive", color="gray", alpha=.7, label="actual positives growth")
-    plt.plot(to_plot["index"], linear_fit, color="black", label="projected growth")
-    plt.plot(to_plot["index"], exp_fit, color="red", label="exponential fit")
+        ax.vlines(forecast.projection_index, linear_fit[forecast.projection_index],
+            linear_fit[forecast.projection_index]*fit_thresholds[0], colors="black", linestyles="dashed")
+        ax.vlines(forecast.projection_index, exp_fit[forecast.projection_index],
+            exp_fit[forecast.projection_index]*fit_thresholds[1], colors="red", linestyles="dashed")
 
-    plt.vlines(forecast.projection_index, linear_fit[forecast.projection_index],
-        linear_fit[forecast.projection_index]*fit_thresholds[0], colors="black", linestyles="dashed")
-    plt.vlines(forecast.projection_index, exp_fit[forecast.projection_index],
-        exp_fit[forecast.projection_index]*fit_thresholds[1], colors="red", linestyles="dashed")
 
+        first_datetime = datetime.strptime(str(forecast.cases_df["date"].min()), '%Y%m%d')
+        projection_datetime = datetime.strptime(str(forecast.date), '%Y%m%d')
+        delta = projection_datetime - first_datetime
 
-    first_datetime = datetime.strptime(str(forecast.cases_df["date"].min()), '%Y%m%d')
-    projection_datetime = datetime.strptime(str(forecast.date), '%Y%m%d')
-    delta = projection_datetime - first_datetime
+        plotted_dates = [(first_datetime + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(delta.days + 1)]
 
-    plotted_dates = [(first_datetime + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(delta.days + 1)]
+        ax.set_title(f"{forecast.state} ({forecast.date}): {forecast.actual_value} positives, expected between {forecast.expected_linear} and {forecast.expected_exp}")
+        ax.set_xticklabels(plotted_dates, rotation=90)
+        ax.set_xlabel("Day")
+        ax.set_ylabel("Number of positive cases")
+        ax.set_ylim(0, np.ceil(max(forecast.results)*1.2))
+        ax.legend()
 
-    plt.title(f"{forecast.state} ({forecast.date}): {forecast.actual_value} positives, expected between {forecast.expected_linear} and {forecast.expected_exp}")
-    ax.set_xticklabels(plotted_dates, rotation=90)
-    plt.xlabel("Day")
-    plt.ylabel("Number of positive cases")
-    plt.ylim(0, np.ceil(max(forecast.results)*1.2))
-    plt.legend()
+        # TODO: Might want to save these to s3?
+        # This write-to-file step adds ~1 sec of runtime / state
 
-    # TODO: Might want to save these to s3?
-    # This write-to-file step adds ~1 sec of runtime / state
+        if not os.path.isdir(image_dir): os.makedirs(image_dir)
 
-    if not os.path.isdir(image_dir): os.makedirs(image_dir)
+        fn = f"predicted_positives_{forecast.state}_{forecast.date}.png"
+        fig.savefig(os.path.join(image_dir, fn), dpi=250, bbox_inches = "tight")
+    finally:
+        if own_fig:
+            plt.close(fig)
+
+
+# small multiples: one panel per state
+PANEL_SIZE = (2.4, 1.8)
+PANEL_COLUMNS = 8
+BATCH_DPI = 100
+THUMBNAIL_DPI = 60
+
+def _plot_panel(ax, forecast: Forecast, fit_thresholds: list):
+    " compact version of plot_to_file for one state "
+
+    x = np.append(forecast.cases_df["index"].values, forecast.projection_index).astype(float)
+    y = np.append(forecast.cases_df["positive"].values, forecast.actual_value).astype(float)
+    exp_fit = _exp_fit(x, *forecast.fitted_exp_params)
+    linear_fit = _linear_fit(x, *forecast.fitted_linear_params)
+
+    ax.bar(x, y, color="gray", alpha=.7, width=0.8)
+    ax.plot(x, linear_fit, color="black", linewidth=1)
+    ax.plot(x, exp_fit, color="red", linewidth=1)
+    if forecast.fitted_logistic_params is not None:
+        ax.plot(x, _logistic_fit(x, *forecast.fitted_logistic_params), color="blue", linewidth=1)
 
-    fn = f"predicted_positives_{forecast.state}_{forecast.date}.png"
-    plt.savefig(os.path.join(image_dir, fn), dpi=250, bbox_inches = "tight")
+    p = forecast.projection_index
+    ax.vlines(p, linear_fit[-1], linear_fit[-1]*fit_thresholds[0], colors="black", linestyles="dashed", linewidth=1)
+    ax.vlines(p, exp_fit[-1], exp_fit[-1]*fit_thresholds[1], colors="red", linestyles="dashed", linewidth=1)
+
+    ax.set_title(f"{forecast.state}: {forecast.actual_value:,} ({forecast.expected_linear:,}-{forecast.expected_exp:,})", fontsize=8)
+    ax.set_ylim(0, np.ceil(max(forecast.results)*1.2))
+    ax.set_xticks([])
+    ax.tick_params(axis="y", labelsize=6)
+
+def plot_all_to_file(forecasts: list, image_dir: str, fit_thresholds: list, thumbnails: bool = False) -> str:
+    """ plot all the forecasts on one faceted figure
+
+    writes {image_dir}/predicted_positives_all_{date}.png and, with thumbnails,
+    a small {image_dir}/thumbnails/predicted_positives_{state}_{date}.png per state.
+    returns the path of the combined image.
+    """
+
+    forecasts = sorted([f for f in forecasts if f is not None], key=lambda f: str(f.state))
+    if len(forecasts) == 0:
+        raise Exception("Missing forecasts")
+
+    if not os.path.isdir(image_dir): os.makedirs(image_dir)
 
+    n_cols = min(PANEL_COLUMNS, len(forecasts))
+    n_rows = (len(forecasts) + n_cols - 1) // n_cols
+    fig, axes = plt.subplots(n_rows, n_cols, squeeze=False,
+        figsize=(PANEL_SIZE[0] * n_cols, PANEL_SIZE[1] * n_rows))
+    try:
+        for ax, forecast in zip(axes.flat, forecasts):
+            _plot_panel(ax, forecast, fit_thresholds)
+        for ax in axes.flat[len(forecasts):]:
+            ax.set_visible(False)
+
+        run_date = max(f.date for f in forecasts)
+        fig.suptitle(f"Positives vs linear (black) and exponential (red) forecasts for {run_date}")
+        fig.tight_layout(rect=(0, 0, 1, 0.97))
+
+        path = os.path.join(image_dir, f"predicted_positives_all_{run_date}.png")
+        fig.savefig(path, dpi=BATCH_DPI)
+    finally:
+        plt.close(fig)
+
+    if thumbnails:
+        thumb_dir = os.path.join(image_dir, "thumbnails")
+        if not os.path.isdir(thumb_dir): os.makedirs(thumb_dir)
+
+        fig = plt.figure(figsize=PANEL_SIZE)
+        try:
+            for forecast in forecasts:
+                fig.clf()
+                _plot_panel(fig.add_subplot(111), forecast, fit_thresholds)
+                fig.tight_layout()
+                fn = f"predicted_positives_{forecast.state}_{forecast.date}.png"
+                fig.savefig(os.path.join(thumb_dir, fn), dpi=THUMBNAIL_DPI)
+        finally:
+            plt.close(fig)
+
+    logger.debug(f"  plotted {len(forecasts)} forecasts to {path}")
+    return path
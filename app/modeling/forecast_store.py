@@ -0,0 +1,191 @@
+#
+# Forecast Store -- all the forecasts of a run in one HDF5 file
+#
+#   The forecasts are kept in memory while the run is going (the plot
+#   phase reads them from there) and written in one HDFStore session by
+#   save().  Each state is a group, /index is a table of (state, date) to
+#   group plus the projected values.
+#
+#   get(state, date) looks in memory first then in the saved runs, newest
+#   first.  prune() keeps the newest keep_runs files in results_dir.
+#
+#   The batch plot mode also uses a store (without saving it) to collect
+#   the forecasts of the run.
+#
+
+import os
+import glob
+from datetime import datetime
+from typing import Dict, List, Tuple
+import pandas as pd
+from loguru import logger
+
+from .forecast import Forecast
+
+RUN_PREFIX = "forecasts_"
+DEFAULT_KEEP_RUNS = 24
+
+
+def _plain(df: pd.DataFrame) -> pd.DataFrame:
+    " fixed-format HDF5 cannot store categoricals "
+    columns = [c for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)]
+    if len(columns) == 0: return df
+    return df.astype({c: str for c in columns})
+
+
+def _run_time(path: str) -> str:
+    " the YYYYmmdd_HHMMSS of a run file "
+    return "_".join(os.path.basename(path)[:-len(".h5")].rsplit("_", 2)[-2:])
+
+
+class ForecastStore:
+    " forecasts for one run, indexed by (state, date) "
+
+    def __init__(self, results_dir: str, name: str, keep_runs: int = DEFAULT_KEEP_RUNS):
+        self.results_dir = results_dir
+        self.keep_runs = keep_runs
+
+        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.path = os.path.join(results_dir, f"{RUN_PREFIX}{name}_{ts}.h5")
+
+        self._forecasts: Dict[Tuple[str, int], Forecast] = {}
+        # path -> index of a saved run
+        self._runs: Dict[str, pd.DataFrame] = {}
+
+    def __len__(self) -> int:
+        return len(self._forecasts)
+
+    def add(self, forecast: Forecast):
+        self._forecasts[(str(forecast.state), int(forecast.date))] = forecast
+
+    def all(self) -> List[Forecast]:
+        " the forecasts of this run, in state order "
+        return [self._forecasts[k] for k in sorted(self._forecasts)]
+
+    def get(self, state: str, date: int) -> Forecast:
+        " get the forecast for (state, date), None if there isn't one "
+        key = (str(state), int(date))
+        forecast = self._forecasts.get(key)
+        if forecast is not None:
+            return forecast
+
+        for path in self.saved_runs():
+            if path == self.path: continue
+            forecast = self._load(path, key)
+            if forecast is not None:
+                return forecast
+        return None
+
+    def find_last(self, state: str, date: int) -> Forecast:
+        " get the newest forecast for state before date, None if there isn't one "
+        state = str(state)
+        dates = [d for s, d in self._forecasts if s == state and d < date]
+        if len(dates) > 0:
+            return self._forecasts[(state, max(dates))]
+
+        for path in self.saved_runs():
+            if path == self.path: continue
+            index = self._read_index(path)
+            if index is None: continue
+            dates = [d for s, d in index.index if s == state and d < date]
+            if len(dates) > 0:
+                return self._load(path, (state, int(max(dates))))
+        return None
+
+    def saved_runs(self) -> List[str]:
+        """ saved run files in results_dir, newest first
+
+        sorted by the run time in the file name, another run can be pruning the files
+        """
+        paths = glob.glob(os.path.join(self.results_dir, f"{RUN_PREFIX}*.h5"))
+        return sorted(paths, key=lambda p: (_run_time(p), p), reverse=True)
+
+    def save(self) -> str:
+        " write all the forecasts in one session, returns the path "
+        if len(self._forecasts) == 0:
+            return None
+        if not os.path.isdir(self.results_dir): os.makedirs(self.results_dir)
+
+        index = []
+        tmp_path = self.path + ".tmp"
+        with pd.HDFStore(tmp_path, mode="w") as store:
+            for i, ((state, date), forecast) in enumerate(sorted(self._forecasts.items())):
+                group = f"f{i}"
+                store.put(f"{group}/df", _plain(forecast.df))
+                store.put(f"{group}/cases_df", _plain(forecast.cases_df))
+                store.put(f"{group}/fitted_params", pd.DataFrame({
+                    "linear": forecast.fitted_linear_params,
+                    "exp": forecast.fitted_exp_params
+                }))
+                if forecast.fitted_logistic_params is not None:
+                    store.put(f"{group}/logistic_params", pd.Series(forecast.fitted_logistic_params))
+                index.append({
+                    "state": state,
+                    "date": date,
+                    "group": group,
+                    "actual_value": forecast.actual_value,
+                    "expected_exp": forecast.expected_exp,
+                    "expected_linear": forecast.expected_linear,
+                    "expected_logistic": forecast.expected_logistic,
+                    "projection_index": forecast.projection_index,
+                })
+            store.put("index", pd.DataFrame(index).set_index(["state", "date"]))
+        os.replace(tmp_path, self.path)
+
+        logger.info(f"   saved {len(index)} forecasts to {self.path}")
+        self.prune()
+        return self.path
+
+    def prune(self):
+        " remove the oldest runs, keep the newest keep_runs "
+        for path in self.saved_runs()[self.keep_runs:]:
+            try:
+                os.remove(path)
+                self._runs.pop(path, None)
+                logger.debug(f"   pruned {path}")
+            except FileNotFoundError:
+                # pruned by another run
+                self._runs.pop(path, None)
+            except Exception as ex:
+                logger.warning(f"   could not prune {path}: {ex}")
+
+    def _read_index(self, path: str) -> pd.DataFrame:
+        index = self._runs.get(path)
+        if index is None:
+            try:
+                index = pd.read_hdf(path, "index")
+            except Exception as ex:
+                logger.warning(f"   could not read index of {path}: {ex}")
+                return None
+            self._runs[path] = index
+        return index
+
+    def _load(self, path: str, key: Tuple[str, int]) -> Forecast:
+        index = self._read_index(path)
+        if index is None or key not in index.index:
+            return None
+        try:
+            x = index.loc[key]
+
+            forecast = Forecast()
+            forecast.state, forecast.date = key
+            forecast.actual_value = x["actual_value"]
+            forecast.expected_exp = x["expected_exp"]
+            forecast.expected_linear = x["expected_linear"]
+            forecast.expected_logistic = x.get("expected_logistic", 0)
+            forecast.projection_index = x["projection_index"]
+
+            with pd.HDFStore(path, mode="r") as store:
+                forecast.df = store.get(f"{x['group']}/df")
+                forecast.cases_df = store.get(f"{x['group']}/cases_df")
+                df_pars = store.get(f"{x['group']}/fitted_params")
+                if f"/{x['group']}/logistic_params" in store.keys():
+                    forecast.fitted_logistic_params = store.get(f"{x['group']}/logistic_params").values
+            forecast.fitted_linear_params = df_pars.linear.values
+            forecast.fitted_exp_params = df_pars.exp.values
+        except Exception as ex:
+            logger.warning(f"   could not load {key} from {path}: {ex}")
+            return None
+
+        logger.debug(f"   loaded {key} from {path}")
+        return forecast
@@ -0,0 +1,176 @@
+#
+# Render Queue -- plot forecasts in background worker processes
+#
+#   submit() returns right away, the checks do not wait for the images.
+#   Each worker switches matplotlib to Agg and reuses one figure for all
+#   of its renders.  The workers are started by a forkserver since the
+#   queue is created inside the threaded service.
+#
+#   A sidecar {png}.sha1 holds the hash of the forecast that produced the
+#   image so an unchanged forecast is not rendered again.
+#
+
+import os
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+from threading import Lock
+from typing import Dict
+import numpy as np
+from loguru import logger
+
+from .forecast import Forecast
+
+# bump when plot_to_file changes so the images are redrawn
+RENDER_VERSION = 1
+
+# the figure reused by a worker process
+g_fig = None
+
+
+def image_path(forecast: Forecast, image_dir: str) -> str:
+    return os.path.join(image_dir, f"predicted_positives_{forecast.state}_{forecast.date}.png")
+
+def forecast_digest(forecast: Forecast, fit_thresholds: list) -> str:
+    " hash of everything that goes into the plot "
+    h = hashlib.sha1()
+    h.update(f"{RENDER_VERSION}|{forecast.state}|{forecast.date}|{forecast.actual_value}|".encode("utf-8"))
+    h.update(f"{forecast.expected_linear}|{forecast.expected_exp}|{forecast.projection_index}|".encode("utf-8"))
+    h.update(f"{list(fit_thresholds)}|".encode("utf-8"))
+    h.update(np.asarray(forecast.fitted_linear_params, dtype=float).tobytes())
+    h.update(np.asarray(forecast.fitted_exp_params, dtype=float).tobytes())
+    if forecast.fitted_logistic_params is not None:
+        h.update(np.asarray(forecast.fitted_logistic_params, dtype=float).tobytes())
+    for c in ["index", "date", "positive"]:
+        h.update(np.ascontiguousarray(forecast.cases_df[c].values, dtype=float).tobytes())
+    return h.hexdigest()
+
+def is_rendered(path: str, digest: str) -> bool:
+    " check if the png at path was made from a forecast with this digest "
+    if not os.path.exists(path): return False
+    try:
+        with open(path + ".sha1", "r") as f:
+            return f.read().strip() == digest
+    except OSError:
+        return False
+
+
+def _init_worker():
+    global g_fig
+    import matplotlib.pyplot as plt
+    plt.switch_backend("Agg")
+    g_fig = plt.figure()
+
+def _render(forecast: Forecast, image_dir: str, fit_thresholds: list, digest: str) -> str:
+    from .forecast_plot import plot_to_file
+
+    plot_to_file(forecast, image_dir, fit_thresholds, fig=g_fig)
+    g_fig.clf()
+
+    path = image_path(forecast, image_dir)
+    with open(path + ".sha1", "w") as f:
+        f.write(digest)
+    return path
+
+
+def _render_all(forecasts: list, image_dir: str, fit_thresholds: list, thumbnails: bool, digest: str) -> str:
+    from .forecast_plot import plot_all_to_file
+
+    path = plot_all_to_file(forecasts, image_dir, fit_thresholds, thumbnails)
+    with open(path + ".sha1", "w") as f:
+        f.write(digest)
+    return path
+
+
+class RenderQueue:
+    " render forecast plots in worker processes "
+
+    def __init__(self, n_workers: int):
+        self.n_workers = n_workers
+        self._pool = ProcessPoolExecutor(n_workers, mp_context=multiprocessing.get_context("forkserver"),
+            initializer=_init_worker)
+
+        # png path -> digest of the render in progress
+        self._pending: Dict[str, str] = {}
+        self._lock = Lock()
+
+    def submit(self, forecast: Forecast, image_dir: str, fit_thresholds: list) -> Future:
+        " queue a render, returns None if the image is already up-to-date "
+
+        path = image_path(forecast, image_dir)
+        digest = forecast_digest(forecast, fit_thresholds)
+        with self._lock:
+            if self._pending.get(path) == digest or is_rendered(path, digest):
+                return None
+            self._pending[path] = digest
+
+        future = self._pool.submit(_render, forecast, image_dir, fit_thresholds, digest)
+        future.add_done_callback(lambda f: self._done(path, digest, f))
+        return future
+
+    def submit_all(self, forecasts: list, image_dir: str, fit_thresholds: list, thumbnails: bool = False) -> Future:
+        " queue a small-multiples render of all the forecasts, returns None if it is up-to-date "
+
+        forecasts = sorted(forecasts, key=lambda f: str(f.state))
+        if len(forecasts) == 0: return None
+
+        date = max(f.date for f in forecasts)
+        path = os.path.join(image_dir, f"predicted_positives_all_{date}.png")
+        h = hashlib.sha1(f"{RENDER_VERSION}|{thumbnails}|".encode("utf-8"))
+        for f in forecasts:
+            h.update(forecast_digest(f, fit_thresholds).encode("utf-8"))
+        digest = h.hexdigest()
+
+        with self._lock:
+            if self._pending.get(path) == digest or is_rendered(path, digest):
+                return None
+            self._pending[path] = digest
+
+        future = self._pool.submit(_render_all, forecasts, image_dir, fit_thresholds, thumbnails, digest)
+        future.add_done_callback(lambda f: self._done(path, digest, f))
+        return future
+
+    def _done(self, path: str, digest: str, future: Future):
+        with self._lock:
+            if self._pending.get(path) == digest:
+                del self._pending[path]
+        ex = future.exception()
+        if ex is not None:
+            logger.error(f"  could not render {path}: {ex}")
+        else:
+            logger.debug(f"  rendered {path}")
+
+    @property
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def shutdown(self, wait: bool = True):
+        if wait and self.pending > 0:
+            logger.info(f"  waiting for {self.pending} images")
+        self._pool.shutdown(wait=wait)
+
+
+g_render_queue: RenderQueue = None
+g_render_lock = Lock()
+
+def get_render_queue(n_workers: int) -> RenderQueue:
+    " get the shared render queue, created on first use and rebuilt if n_workers changes "
+    global g_render_queue
+    with g_render_lock:
+        if g_render_queue is not None and g_render_queue.n_workers != n_workers:
+            logger.info(f"render workers changed to {n_workers}")
+            # drain the old queue so no image is lost
+            g_render_queue.shutdown()
+            g_render_queue = None
+        if g_render_queue is None:
+            g_render_queue = RenderQueue(n_workers)
+        return g_render_queue
+
+def shutdown_render_queue():
+    " wait for the queued images and stop the workers "
+    global g_render_queue
+    with g_render_lock:
+        if g_render_queue is not None:
+            g_render_queue.shutdown()
+            g_render_queue = None
@@ -12,18 +12,36 @@ class QCConfig():
         results_dir = "results",
         images_dir = "images", 
         save_results = False,
+        keep_runs = 24,
         plot_models = False,
+        plot_mode = "single",
+        plot_thumbnails = False,
+        prefetch = True,
+        vectorized_checks = True,
+        forecast_engine = "batch",
+        upper_model = "exp",
+        forecast_workers = 0,
+        render_workers = 0,
         ):
 
         # checks
         self.results_dir = results_dir # place to store hdf5 files
         self.save_results = save_results # save results to an hdf5 file
+        self.keep_runs = keep_runs # number of saved runs to keep in results_dir
         self.enable_experimental = enable_experimental # rerun stuff still in development
         self.enable_debug = enable_debug # turn on tracing
+        self.prefetch = prefetch # load all needed sources at the same time
+        self.vectorized_checks = vectorized_checks # evaluate row checks over the whole frame
 
         # forecast
         self.images_dir = images_dir # place to store images
         self.plot_models = plot_models # generate model curves for forecast
+        self.plot_mode = plot_mode # single (one image per state) or batch (all states on one image)
+        self.plot_thumbnails = plot_thumbnails # batch mode also writes a small image per state
+        self.forecast_engine = forecast_engine # batch (all states at once) or scipy (curve_fit per state)
+        self.upper_model = upper_model # exp or logistic curve as the upper bound of the forecast
+        self.forecast_workers = forecast_workers # processes for fit/project/save/plot, 0 runs them in the row loop
+        self.render_workers = render_workers # processes for plotting in the background, 0 plots inline
 
         # format
         self.show_dates = False # request more date context in messages 
@@ -0,0 +1,76 @@
+#
+# Import Budget -- keep cold start of the CLI and the flask workers fast
+#
+#   Each entry point is imported in a fresh interpreter.  The check fails
+#   if the import takes longer than its budget or if it pulls in one of the
+#   heavy modules that should only load when a forecast or plot is needed.
+#
+#   tests/test_import_budget.py runs it under pytest (CI), or from the
+#   repo root:  python -m app.util.import_budget
+#
+
+import os
+import sys
+import json
+import subprocess
+from typing import Dict, List
+from loguru import logger
+
+# module -> seconds
+BUDGETS = {
+    "run_quality_cli": 3.0,
+    "run_quality_service": 2.0,
+    "flaskcheck": 2.0,
+}
+
+# modules that must not be loaded by importing the entry points
+LAZY_MODULES = ["matplotlib", "scipy", "h5py", "tables", "googleapiclient"]
+
+PROBE = """
+import sys, time, json
+t = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t
+print(json.dumps({{"elapsed": elapsed, "modules": sorted(sys.modules)}}))
+"""
+
+
+def measure(module: str, cwd: str) -> Dict:
+    " import module in a fresh interpreter, returns the elapsed time and the loaded modules "
+    r = subprocess.run([sys.executable, "-c", PROBE.format(module=module)],
+        cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    return json.loads(r.stdout.decode("utf-8").strip().splitlines()[-1])
+
+
+def check_budgets(cwd: str) -> List[str]:
+    " returns a list of problems, empty if all the entry points are within budget "
+
+    problems = []
+    for module, budget in BUDGETS.items():
+        try:
+            x = measure(module, cwd)
+        except subprocess.CalledProcessError as ex:
+            problems.append(f"{module}: import failed\n{ex.stderr.decode('utf-8')}")
+            continue
+
+        loaded = [m for m in LAZY_MODULES if m in x["modules"]]
+        logger.info(f"  {module}: {x['elapsed']:.2f}s (budget {budget:.2f}s)")
+        if x["elapsed"] > budget:
+            problems.append(f"{module}: import took {x['elapsed']:.2f}s, budget is {budget:.2f}s")
+        if len(loaded) > 0:
+            problems.append(f"{module}: imports {', '.join(loaded)} at load")
+    return problems
+
+
+def main():
+
+    cwd = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+    problems = check_budgets(cwd)
+    for p in problems:
+        logger.error(p)
+    if len(problems) > 0:
+        sys.exit(1)
+    logger.info("import budget ok")
+
+if __name__ == "__main__":
+    main()
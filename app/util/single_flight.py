@@ -0,0 +1,55 @@
+#
+# Single Flight -- run a computation once for all concurrent callers
+#
+#   The first caller runs the function, callers that arrive while it is
+#   running wait for it and get the same result (or exception).
+#
+
+from threading import Lock, Event
+from typing import Any, Callable
+
+
+class _Call:
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error: Exception = None
+
+
+class SingleFlight:
+    " at most one running computation, shared by every concurrent caller "
+
+    def __init__(self):
+        self._lock = Lock()
+        self._call: _Call = None
+
+    @property
+    def in_flight(self) -> bool:
+        with self._lock:
+            return self._call is not None
+
+    def do(self, fn: Callable[[], Any]) -> Any:
+        " run fn, or wait for the run that is already in progress "
+
+        with self._lock:
+            call = self._call
+            leader = call is None
+            if leader:
+                call = self._call = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as ex:
+            call.error = ex
+            raise
+        finally:
+            with self._lock:
+                self._call = None
+            call.done.set()
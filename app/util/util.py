@@ -1,6 +1,5 @@
 import os
 import sys
-import requests
 from loguru import logger
 import re
 from typing import Tuple, List, Dict, Callable
@@ -9,6 +8,7 @@ from requests.packages import urllib3
 import configparser
 
 from .udatetime import *
+from app.data.http_session import get_session
 
 urllib3.disable_warnings()
 
@@ -75,7 +75,7 @@ state_abbrevs = {
 def fetch_with_requests(page: str) -> [bytes, int]:
     " check data using requests "
     try:
-        resp = requests.get(page, verify=False, timeout=30)
+        resp = get_session().get(page, verify=False, timeout=30)
         return resp.content, resp.status_code
     except Exception as ex:
         logger.error(f"Exception: {ex}")
@@ -0,0 +1,323 @@
+#
+# Vectorized Check Routines
+#
+#   Same rules as the row-level routines in checks.py, evaluated over the
+#   whole working/current frame with boolean masks.  Python only runs for
+#   the rows that fail, to format their messages.
+#
+#   Messages are collected per row and replayed into the ResultLog by the
+#   row loop in check_dataset so the log ends up with the same messages in
+#   the same order as calling the checks.py routines one row at a time.
+#
+#   WHEN YOU CHANGE A CHECK IN checks.py, MAKE THE SAME CHANGE HERE
+#
+
+from typing import Any, Dict, List, Tuple
+import pandas as pd
+import numpy as np
+from loguru import logger
+
+from .qc_config import QCConfig
+from .log.result_log import ResultLog, ResultCategory
+from .checks import START_OF_TIME, COUNTY_ERROR_THRESHOLDS, bad_value_msg
+
+
+class RowMessages:
+    " messages for each row of a frame, in the order the rules were applied "
+
+    def __init__(self):
+        self._messages: Dict[Any, List[Tuple[ResultCategory, str, str]]] = {}
+
+    def add(self, idx: Any, category: ResultCategory, location: str, message: str):
+        items = self._messages.get(idx)
+        if items is None:
+            self._messages[idx] = items = []
+        items.append((category, location, message))
+
+    def emit(self, idx: Any, log: ResultLog):
+        " add the messages for a row to the log "
+        for category, location, message in self._messages.get(idx, []):
+            log.add(category, location, message)
+
+
+def _values(df: pd.DataFrame, name: str) -> np.ndarray:
+    return df[name].values
+
+def _has_message(df: pd.DataFrame, name: str) -> np.ndarray:
+    " matches `if msg:` on the per-row value, false if the column is missing "
+    if name not in df.columns:
+        return np.zeros(df.shape[0], dtype=bool)
+    return df[name].astype(bool).values
+
+def _hours(later: pd.Series, earlier: pd.Series) -> np.ndarray:
+    return ((later - earlier).dt.total_seconds() / (60.0 * 60)).values
+
+def _percent(n: np.ndarray, n_tot: np.ndarray) -> np.ndarray:
+    result = np.zeros(n_tot.shape, dtype=float)
+    np.divide(100.0 * n, n_tot, out=result, where=n_tot > 0)
+    return result
+
+
+# ----------------------------------------------------------------
+
+
+def total(df: pd.DataFrame, out: RowMessages):
+    """Check that pendings, positive, and negative sum to the reported total"""
+
+    n_pos, n_neg, n_pending, n_death, n_tot = [
+        _values(df, c) for c in ["positive", "negative", "pending", "death", "total"]]
+
+    # allow blanks
+    n_pending = np.where(n_pending == -1000, 0, n_pending)
+
+    bad_pos, bad_neg, bad_pending, bad_death = n_pos < 0, n_neg < 0, n_pending < 0, n_death < 0
+    is_bad = bad_pos | bad_neg | bad_pending | bad_death
+
+    n_diff = n_tot - (n_pos + n_neg + n_pending)
+    bad_tot = ~is_bad & (n_tot < 0)
+    broken = ~is_bad & ~bad_tot & (n_diff != 0)
+
+    states = _values(df, "state")
+    for i in np.flatnonzero(is_bad | bad_tot | broken):
+        idx, state = df.index[i], states[i]
+        if bad_pos[i]:
+            out.add(idx, ResultCategory.DATA_ENTRY, state, bad_value_msg("positive", n_pos[i]))
+        if bad_neg[i]:
+            out.add(idx, ResultCategory.DATA_ENTRY, state, bad_value_msg("negative", n_neg[i]))
+        if bad_pending[i]:
+            out.add(idx, ResultCategory.DATA_ENTRY, state, bad_value_msg("pending", n_pending[i]))
+        if bad_death[i]:
+            out.add(idx, ResultCategory.DATA_ENTRY, state, bad_value_msg("death", n_death[i]))
+        if bad_tot[i]:
+            out.add(idx, ResultCategory.DATA_ENTRY, state, bad_value_msg("total", n_tot[i]))
+        elif broken[i]:
+            out.add(idx, ResultCategory.DATA_ENTRY, state,
+                f"Formula broken -> Positive ({n_pos[i]}) + Negative ({n_neg[i]}) + Pending ({n_pending[i]}) != Total ({n_tot[i]}), delta = {n_diff[i]}")
+
+
+def last_update(df: pd.DataFrame, out: RowMessages):
+    """Source has updated within a reasonable timeframe"""
+
+    has_msg = _has_message(df, "lastUpdateEt_msg")
+    days = _hours(df["targetDateEt"], df["lastUpdateEt"]) / 24.0
+    is_old = ~has_msg & (days >= 2.0)
+
+    states = _values(df, "state")
+    for i in np.flatnonzero(has_msg | is_old):
+        idx, state = df.index[i], states[i]
+        if has_msg[i]:
+            msg = df["lastUpdateEt_msg"].values[i]
+            out.add(idx, ResultCategory.DATA_ENTRY, state, f"Last Update (DT) is {msg}")
+        else:
+            out.add(idx, ResultCategory.DATA_SOURCE, state, f"source hasn't updated in {days[i]:.0f} days")
+
+
+def last_checked(df: pd.DataFrame, out: RowMessages, config: QCConfig):
+    """Data was checked within a reasonable timeframe"""
+
+    if not config.is_near_release:
+        return
+
+    has_msg = _has_message(df, "lastCheckEt_msg")
+
+    hours_behind = _hours(df["lastUpdateEt"], df["lastCheckEt"])
+    is_behind = ~has_msg & (hours_behind > 1.0)
+
+    hours_old = _hours(df["targetDateEt"], df["lastCheckEt"])
+    is_old = ~has_msg & ~is_behind & (hours_old > 6.0)
+
+    states = _values(df, "state")
+    for i in np.flatnonzero(has_msg | is_behind | is_old):
+        idx, state = df.index[i], states[i]
+        if has_msg[i]:
+            msg = df["lastCheckEt_msg"].values[i]
+            out.add(idx, ResultCategory.DATA_ENTRY, state, f"Last Checked (DT) is {msg}")
+            continue
+
+        s_checked = df["lastCheckEt"].iloc[i].strftime("%m/%d %H:%M")
+        if is_behind[i]:
+            if hours_behind[i] > 2000:
+                out.add(idx, ResultCategory.DATA_ENTRY, state, "Last Check ET (column AJ) is blank")
+            else:
+                s_updated = df["lastUpdateEt"].iloc[i].strftime("%m/%d %H:%M")
+                out.add(idx, ResultCategory.DATA_ENTRY, state,
+                    f"Last Check ET (column AJ) is {s_checked} which is less than Last Update ET (column AI)  {s_updated} by {hours_behind[i]:.0f} hours")
+        else:
+            checker = df["checker"].values[i]
+            out.add(idx, ResultCategory.DATA_ENTRY, state,
+                f"Last Check ET (column AJ) has not been updated in {hours_old[i]:.0f} hours ({s_checked} by {checker})")
+
+
+def checkers_initials(df: pd.DataFrame, out: RowMessages, config: QCConfig):
+    """Confirm that checker initials are records"""
+
+    is_checked = ~(df["lastCheckEt"] <= START_OF_TIME).values
+
+    checker = df["checker"].str.strip().values
+    double_checker = df["doubleChecker"].str.strip().values
+
+    delta_hours = _hours(df["targetDateEt"], df["lastCheckEt"])
+
+    no_checker = is_checked & (checker == "")
+    is_recent = no_checker & (0 < delta_hours) & (delta_hours < 5)
+    is_missing = no_checker & ~is_recent & config.is_near_release
+    no_double = is_checked & ~no_checker & (double_checker == "") & config.is_near_release
+
+    states = _values(df, "state")
+    for i in np.flatnonzero(is_recent | is_missing | no_double):
+        idx, state = df.index[i], states[i]
+        if is_recent[i]:
+            s_checked = df["lastCheckEt"].iloc[i].strftime("%m/%d %H:%M")
+            out.add(idx, ResultCategory.DATA_ENTRY, state,
+                f"missing checker initials (column AK) but checked date set recently (at {s_checked})")
+        elif is_missing[i]:
+            out.add(idx, ResultCategory.DATA_ENTRY, state, "missing checker initials (column AK)")
+        else:
+            out.add(idx, ResultCategory.DATA_ENTRY, state, "missing double-checker initials (column AL)")
+
+
+def positives_rate(df: pd.DataFrame, out: RowMessages):
+    """Check that positives compose <20% test results"""
+
+    n_pos, n_neg = _values(df, "positive"), _values(df, "negative")
+    n_tot = n_pos + n_neg
+
+    percent_pos = _percent(n_pos, n_tot)
+    limit = np.where(n_tot > 100, 40.0, 80.0)
+    is_high = (percent_pos > limit) & (n_pos > 20)
+
+    states = _values(df, "state")
+    for i in np.flatnonzero(is_high):
+        out.add(df.index[i], ResultCategory.DATA_QUALITY, states[i],
+            f"high positives rate {percent_pos[i]:.0f}% (positive={n_pos[i]:,}, total={n_tot[i]:,})")
+
+
+def death_rate(df: pd.DataFrame, out: RowMessages):
+    """Check that deaths are <5% of test results"""
+
+    n_pos, n_neg, n_deaths = _values(df, "positive"), _values(df, "negative"), _values(df, "death")
+    n_tot = n_pos + n_neg
+
+    percent_deaths = _percent(n_deaths, n_tot)
+    limit = np.where(n_tot > 100, 5.0, 10.0)
+    is_high = percent_deaths > limit
+
+    states = _values(df, "state")
+    for i in np.flatnonzero(is_high):
+        out.add(df.index[i], ResultCategory.DATA_QUALITY, states[i],
+            f"high death rate {percent_deaths[i]:.0f}% (positive={n_deaths[i]:,}, total={n_tot[i]:,})")
+
+
+def pendings_rate(df: pd.DataFrame, out: RowMessages):
+    """Check that pendings are not more than 20% of total"""
+
+    n_pos, n_neg, n_pending = _values(df, "positive"), _values(df, "negative"), _values(df, "pending")
+    n_tot = n_pos + n_neg
+
+    percent_pending = _percent(n_pending, n_tot)
+    limit = np.where(n_tot > 1000, 20.0, 80.0)
+    is_high = percent_pending > limit
+
+    states = _values(df, "state")
+    for i in np.flatnonzero(is_high):
+        out.add(df.index[i], ResultCategory.DATA_QUALITY, states[i],
+            f"high pending rate {percent_pending[i]:.0f}% (pending={n_pending[i]:,}, total={n_tot[i]:,})")
+
+
+# ----------------------------------------------------------------
+
+
+def _county_bands(x: pd.DataFrame, actual: str, aggregate: str, small_limit: int, name: str):
+    " add the allowed [min, max] band around the county aggregate and whether actual is inside it "
+
+    is_small = x[actual].values < small_limit
+    lo = np.where(is_small, COUNTY_ERROR_THRESHOLDS[f"{name}-small"][0], COUNTY_ERROR_THRESHOLDS[f"{name}-large"][0])
+    hi = np.where(is_small, COUNTY_ERROR_THRESHOLDS[f"{name}-small"][1], COUNTY_ERROR_THRESHOLDS[f"{name}-large"][1])
+
+    v_min = (lo * x[aggregate].values).astype(int)
+    v_max = (hi * x[aggregate].values + 10).astype(int)
+    x[f"{name}_min"] = v_min
+    x[f"{name}_max"] = v_max
+    x[f"{name}_ok"] = (v_min <= x[actual].values) & (x[actual].values <= v_max)
+
+
+def _median_source(x: pd.DataFrame, by: str) -> pd.DataFrame:
+    " the median source for each row after sorting the sources by `by` "
+    x = x.sort_values(["row", by], kind="mergesort")
+    pos = x.groupby("row", sort=False).cumcount().values
+    return x, x[pos == x["n"].values // 2]
+
+
+def counties_rollup_to_state(df: pd.DataFrame, counties: pd.DataFrame, out: RowMessages):
+    """
+    Check that county totals from NYT, CSBS, CDS datasets are
+    about equal to the reported state totals for all rows at once. Metrics compared are:
+        - positive cases
+        - patient deaths
+    """
+
+    rows = pd.DataFrame({
+        "row": np.arange(df.shape[0]),
+        "state": df["state"].astype(str).values,
+        "positive": df["positive"].values,
+        "death": df["death"].values,
+    })
+    x = rows.merge(counties.assign(state=counties["state"].astype(str)), on="state", how="inner")
+    if x.shape[0] == 0: return
+
+    x["n"] = x.groupby("row")["source"].transform("size")
+    _county_bands(x, "positive", "cases", 500, "positive")
+    _county_bands(x, "death", "deaths", 50, "death")
+
+    # use median
+    x, mid = _median_source(x, "cases")
+    for r in mid[(mid.positive > 1000) & ~mid.positive_ok].itertuples():
+        logger.warning(
+            f"  {r.state}: positive ({r.positive:,}) does not match county aggregate ({r.positive_min:,} to {r.positive_max:,})"
+        )
+        out.add(df.index[r.row], ResultCategory.DATA_QUALITY, r.state,
+            f"positive ({r.positive:,}) does not match {r.source} county aggregate ({r.cases:,}, allow {r.positive_min:,} to {r.positive_max:,})")
+
+    x, mid = _median_source(x, "deaths")
+    for r in mid[(mid.death > 200) & ~mid.death_ok].itertuples():
+        logger.warning(
+            f"  {r.state}:   death ({r.death:,}) does not match county aggregate ({r.death_min:,} to {r.death_max:,})"
+        )
+        out.add(df.index[r.row], ResultCategory.DATA_QUALITY, r.state,
+            f"death ({r.death:,}) does not match {r.source} county aggregate ({r.deaths:,}, allow {r.death_min:,} to {r.death_max:,})")
+
+
+# ----------------------------------------------------------------
+
+
+def check_working_rows(df: pd.DataFrame, config: QCConfig) -> RowMessages:
+    " run the row-level working checks, in the same order as check_working "
+
+    out = RowMessages()
+    last_update(df, out)
+    last_checked(df, out, config)
+    checkers_initials(df, out, config)
+    positives_rate(df, out)
+    death_rate(df, out)
+    pendings_rate(df, out)
+    return out
+
+
+def check_county_rows(df: pd.DataFrame, config: QCConfig, counties: pd.DataFrame) -> RowMessages:
+    " run the county rollup check for all rows "
+
+    out = RowMessages()
+    counties_rollup_to_state(df, counties, out)
+    return out
+
+
+def check_current_rows(df: pd.DataFrame, config: QCConfig) -> RowMessages:
+    " run the row-level current checks, in the same order as check_current "
+
+    out = RowMessages()
+    total(df, out)
+    last_update(df, out)
+    positives_rate(df, out)
+    death_rate(df, out)
+    pendings_rate(df, out)
+    return out
@@ -5,11 +5,12 @@
 import os
 from flask import Blueprint, request, jsonify, Response, render_template
 import json
-from typing import Tuple
+from typing import Tuple, Dict, List
 from datetime import datetime
 from loguru import logger
+import serpent
 
-from run_quality_service import get_proxy
+from run_quality_service import get_proxy_pool
 import app.util.udatetime as udatetime
 
 checks = Blueprint("checks", __name__, url_prefix='/checks')
@@ -19,20 +20,39 @@ load_date = udatetime.now_as_eastern()
 def service_load_dates() -> Tuple[datetime, datetime, datetime]:
     " returns flask app start time, Pyro4 service start time, and current time (all ET)"
     try:
-        service = get_proxy()
-        service_date = datetime.fromisoformat(service.load_date)
+        service_date = datetime.fromisoformat(fetch()["load_date"])
         return load_date, service_date, udatetime.now_as_eastern() 
     except Exception as ex:
         logger.exception(ex)
         return load_date, None, udatetime.now_as_eastern()
 
+def fetch(name: str = None, formats: List[str] = None, gzipped: bool = False) -> Dict:
+    " one call to the service for the load date and the outputs of a dataset "
+    result = get_proxy_pool().call(lambda service: service.fetch(name, formats, gzipped))
+    if gzipped:
+        # serpent sends bytes as a base64 dict
+        result["outputs"] = { fmt: serpent.tobytes(x) if isinstance(x, dict) else x
+            for fmt, x in result["outputs"].items() }
+    return result
+
+def send_result(name: str, fmt: str, mimetype: str) -> Response:
+    " send the pre-rendered output, gzipped by the service if the client accepts it "
+    gzipped = "gzip" in request.headers.get("Accept-Encoding", "")
+    data = fetch(name, [fmt], gzipped)["outputs"][fmt]
+    response = Response(data, mimetype=mimetype, status=200)
+    if gzipped:
+        response.headers["Content-Encoding"] = "gzip"
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+def render_result(name: str) -> str:
+    return render_template("check_results.html", result=fetch(name, ["html"])["outputs"]["html"])
+
 
 @checks.route("/working.json", methods=["GET"])
 def working_json():
     try:
-        service = get_proxy()
-        result = service.working_json
-        return Response(result, mimetype="text/json", status=200)
+        return send_result("working", "json", "text/json")
     except Exception as ex:
         logger.exception(f"Exception: {ex}")
         return str(ex), 500
@@ -41,9 +61,7 @@ def working_json():
 @checks.route("/working.html", methods=["GET"])
 def working_html():
     try:
-        service = get_proxy()
-        result = service.working_html
-        return render_template("check_results.html", result=result)
+        return render_result("working")
     except Exception as ex:
         logger.exception(f"Exception: {ex}")
         return str(ex), 500
@@ -52,9 +70,7 @@ def working_html():
 @checks.route("/working.csv", methods=["GET"])
 def working_csv():
     try:
-        service = get_proxy()
-        result = service.working_csv
-        return Response(result, mimetype="text/csv", status=200)
+        return send_result("working", "csv", "text/csv")
     except Exception as ex:
         logger.exception(f"Exception: {ex}")
         return str(ex), 500
@@ -62,9 +78,7 @@ def working_csv():
 @checks.route("/current.json", methods=["GET"])
 def current_json():
     try:
-        service = get_proxy()
-        result = service.current_json
-        return Response(result, mimetype="text/json", status=200)
+        return send_result("current", "json", "text/json")
     except Exception as ex:
         logger.exception(f"Exception: {ex}")
         return str(ex), 500
@@ -73,9 +87,7 @@ def current_json():
 @checks.route("/current.html", methods=["GET"])
 def current_html():
     try:
-        service = get_proxy()
-        result = service.current_html
-        return render_template("check_results.html", result=result)
+        return render_result("current")
     except Exception as ex:
         logger.exception(f"Exception: {ex}")
         return str(ex), 500
@@ -84,9 +96,7 @@ def current_html():
 @checks.route("/current.csv", methods=["GET"])
 def current_csv():
     try:
-        service = get_proxy()
-        result = service.current_csv
-        return Response(result, mimetype="text/csv", status=200)
+        return send_result("current", "csv", "text/csv")
     except Exception as ex:
         logger.exception(f"Exception: {ex}")
         return str(ex), 500
@@ -95,9 +105,7 @@ def current_csv():
 @checks.route("/history.json", methods=["GET"])
 def history_json():
     try:
-        service = get_proxy()
-        result = service.history_json
-        return Response(result, mimetype="text/json", status=200)
+        return send_result("history", "json", "text/json")
     except Exception as ex:
         logger.exception(f"Exception: {ex}")
         return str(ex), 500
@@ -106,9 +114,7 @@ def history_json():
 @checks.route("/history.html", methods=["GET"])
 def history_html():
     try:
-        service = get_proxy()
-        result = service.history_html
-        return render_template("check_results.html", result=result)
+        return render_result("history")
     except Exception as ex:
         logger.exception(f"Exception: {ex}")
         return str(ex), 500
@@ -117,9 +123,7 @@ def history_html():
 @checks.route("/history.csv", methods=["GET"])
 def history_csv():
     try:
-        service = get_proxy()
-        result = service.history_csv
-        return Response(result, mimetype="text/csv", status=200)
+        return send_result("history", "csv", "text/csv")
     except Exception as ex:
         logger.exception(f"Exception: {ex}")
         return str(ex), 500
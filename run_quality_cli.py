@@ -1,5 +1,6 @@
 """run quality checks against the COVID Tracker's human-generated datasets"""
 
+import os
 import sys
 from loguru import logger
 from argparse import ArgumentParser, Namespace, RawDescriptionHelpFormatter
@@ -7,6 +8,10 @@ from argparse import ArgumentParser, Namespace, RawDescriptionHelpFormatter
 from app.util import read_config_file
 from app.qc_config import QCConfig
 from app.data.data_source import DataSource
+from app.data.remote_cache import init_cache
+from app.modeling.forecast_cache import init_forecast_cache
+from app.modeling.render_queue import shutdown_render_queue
+from app.forecast_stage import shutdown_forecast_pool
 from app.check_dataset import check_current, check_working, check_history
 
 
@@ -36,6 +41,9 @@ def load_args_parser(config) -> ArgumentParser:
     enable_experimental = config["CHECKS"]["enable_experimental"] == "True"
     enable_debug = config["CHECKS"]["enable_debug"] == "True"
     plot_models = config["MODEL"]["plot_models"] == "True"
+    plot_thumbnails = config["MODEL"]["plot_thumbnails"] == "True"
+    prefetch = config["CHECKS"]["prefetch"] == "True"
+    vectorized_checks = config["CHECKS"]["vectorized_checks"] == "True"
 
     parser.add_argument(
         '--save', dest='save_results', action='store_true', default=save_results,
@@ -49,19 +57,71 @@ def load_args_parser(config) -> ArgumentParser:
         '--debug', dest='enable_debug', action='store_true', default=enable_debug,
         help='enable debug traces')
 
+    parser.add_argument(
+        '--prefetch', dest='prefetch', action='store_true', default=prefetch,
+        help='load all sources at the same time')
+
+    parser.add_argument(
+        '--vectorized', dest='vectorized_checks', action='store_true', default=vectorized_checks,
+        help='evaluate row checks over the whole dataset')
+
     parser.add_argument(
         '--plot', dest='plot_models', action='store_true', default=plot_models,
         help='plot the model curves')
 
+    parser.add_argument(
+        '--plot_mode',
+        choices=["single", "batch"],
+        default=config["MODEL"]["plot_mode"],
+        help='one image per state (single) or all states on one image (batch)')
+
+    parser.add_argument(
+        '--thumbnails', dest='plot_thumbnails', action='store_true', default=plot_thumbnails,
+        help='write a small image per state in batch plot mode')
+
 
     parser.add_argument(
         '--results_dir',
         default=config["CHECKS"]["results_dir"],
         help='directory for results files')
+    parser.add_argument(
+        '--keep_runs',
+        type=int,
+        default=int(config["CHECKS"]["keep_runs"]),
+        help='number of saved runs to keep in the results directory')
     parser.add_argument(
         '--images_dir',
         default=config["MODEL"]["images_dir"],
         help='directory for model curves')
+    parser.add_argument(
+        '--forecast_engine',
+        choices=["batch", "scipy"],
+        default=config["MODEL"]["forecast_engine"],
+        help='fit forecasts for all states at once (batch) or one state at a time (scipy)')
+    parser.add_argument(
+        '--upper_model',
+        choices=["exp", "logistic"],
+        default=config["MODEL"]["upper_model"],
+        help='model used as the upper bound of the forecast')
+    parser.add_argument(
+        '--forecast_workers',
+        type=int,
+        default=int(config["MODEL"]["forecast_workers"]),
+        help='processes for fitting/plotting forecasts (0 to run them inline)')
+    parser.add_argument(
+        '--render_workers',
+        type=int,
+        default=int(config["MODEL"]["render_workers"]),
+        help='processes for plotting in the background (0 to plot inline)')
+    parser.add_argument(
+        '--cache_dir',
+        default=config["CACHE"]["cache_dir"],
+        help='directory for cached remote sources (shared with the service)')
+    parser.add_argument(
+        '--forecast_cache_size',
+        type=int,
+        default=int(config["CACHE"]["forecast_cache_size"]),
+        help='number of fitted forecasts to keep (0 to always refit)')
 
     return parser
 
@@ -82,10 +142,19 @@ def main() -> None:
     config = QCConfig(
         results_dir=args.results_dir,
         save_results=args.save_results,
+        keep_runs=args.keep_runs,
         enable_experimental=args.enable_experimental,
         enable_debug=args.enable_debug,
         images_dir=args.images_dir,
         plot_models=args.plot_models,
+        plot_mode=args.plot_mode,
+        plot_thumbnails=args.plot_thumbnails,
+        prefetch=args.prefetch,
+        vectorized_checks=args.vectorized_checks,
+        forecast_engine=args.forecast_engine,
+        upper_model=args.upper_model,
+        forecast_workers=args.forecast_workers,
+        render_workers=args.render_workers,
     )
     if config.save_results:
         logger.warning(f"  [save results to {args.results_dir}]")
@@ -95,6 +164,8 @@ def main() -> None:
     if len(args.state) != 0:
         logger.error("  [states filter not implemented]")
 
+    init_cache(args.cache_dir)
+    init_forecast_cache(args.forecast_cache_size, os.path.join(args.cache_dir, "forecasts"))
     ds = DataSource()
 
     if args.check_working:
@@ -121,6 +192,9 @@ def main() -> None:
         else:
             log.print()
 
+    shutdown_forecast_pool()
+    shutdown_render_queue()
+
 
 if __name__ == "__main__":
     main()
@@ -3,42 +3,152 @@
 #
 #  Hold the cache results on a singleton RPC server
 #
+#  Results are recomputed in the background (stale-while-revalidate),
+#  requests get the last completed result right away.
+#
+#  Each snapshot renders its CSV, JSON and HTML (and gzip of each) once,
+#  the properties return the rendered text.
+#
+#  The flask workers import this module for get_proxy_pool so the checks
+#  (and the data/modeling stack) are only imported by the server.
+#  fetch() returns the load date and a dataset's outputs in one round trip.
+#
+import os
+import gzip
+import select
+import json
+import time
+import threading
 import Pyro4
 from loguru import logger
 from datetime import datetime
-
-from app.check_dataset import check_working, check_current, check_history
+from typing import Dict, List, Callable, Any
 
 from app.log.result_log import ResultLog
-from app.data.data_source import DataSource
 from app.qc_config import QCConfig
 import app.util.util as util
 import app.util.udatetime as udatetime
+from app.util.single_flight import SingleFlight
 
 CACHE_DIRECTION = 60
 
+# seconds between scheduler checks for out-of-date results
+SCHEDULER_TICK = 1
+
+DATASETS = ["working", "current", "history"]
+
+# the DataSource groups each dataset's checks use, only their errors go in its result
+DATASET_SOURCES = {
+    "working": ["working", "history", "counties"],
+    "current": ["current", "history", "counties"],
+    "history": ["history"],
+}
+
 load_date = udatetime.now_as_eastern()
 
-def is_out_of_date(log: ResultLog, cache_seconds: int) -> bool:
-    " check if result is out-of-date"
-    if log == None:
-        logger.info("first run") 
-        return True
-    dt = udatetime.now_as_eastern()
-    delta = dt - log.loaded_at
-    t =  int(delta.total_seconds()) 
-    if t > cache_seconds:        
-        logger.info(f"last-run {t:,}s ago -> rerun") 
-        return True
+def run_check(name: str, ds, config: QCConfig) -> "Snapshot":
+    " run the checks for a dataset "
+    from app.check_dataset import check_working, check_current, check_history
+
+    if name == "working":
+        log = check_working(ds, config)
+    elif name == "current":
+        log = check_current(ds, config)
+    elif name == "history":
+        log = check_history(ds)
     else:
-        logger.info(f"last-run at {t:,}s ago -> skip") 
+        raise Exception(f"Unknown dataset {name}")
+    return Snapshot(log, ds, ds.log_for(DATASET_SOURCES[name]))
+
+
+FORMATS = ["csv", "json", "html"]
+
+# fast, the outputs are re-rendered every refresh
+GZIP_LEVEL = 6
+
+
+class Snapshot:
+    """ a completed check run, the result log and the (shared) DataSource it came from
+
+    the outputs are rendered when the snapshot is made (on the refresh thread),
+    not when they are requested.
+    """
+
+    def __init__(self, log: ResultLog, ds, errors):
+        self.log = log
+        self.ds = ds
+        # the ErrorLog of the sources this dataset uses
+        self.errors = errors
+        self.loaded_at = udatetime.now_as_eastern()
+
+        # the last rerun that could not run the checks, this snapshot is still served
+        self.failed_at: datetime = None
+        self.failure = None
+
+        # format -> rendered text / gzip of it
+        self.outputs: Dict[str, str] = {}
+        self.compressed: Dict[str, bytes] = {}
+        for fmt in FORMATS:
+            self.outputs[fmt] = self._render(fmt)
+            self.compressed[fmt] = gzip.compress(self.outputs[fmt].encode("utf-8"), GZIP_LEVEL)
+
+    @property
+    def result(self):
+        " the result log, or the data source errors if the checks could not run "
+        return self.log if self.log is not None else self.errors
+
+    def _render(self, fmt: str) -> str:
+        result = self.result
+        if fmt == "csv": return result.to_csv()
+        if fmt == "html": return result.to_html()
+        if fmt == "json":
+            # ErrorLog.to_json returns a dict
+            x = result.to_json()
+            return x if isinstance(x, str) else json.dumps(x, indent=2)
+        raise Exception(f"Unknown format {fmt}")
+
+    @property
+    def age(self) -> float:
+        return (udatetime.now_as_eastern() - self.loaded_at).total_seconds()
+
+    @property
+    def checked_at(self) -> datetime:
+        " time of the last run, completed or not "
+        return self.failed_at if self.failed_at is not None else self.loaded_at
+
+    @property
+    def version(self) -> int:
+        " version of the data the checks ran on "
+        return self.ds.version
+
 
 class CheckServer:
-    f"cache the check results for {CACHE_DIRECTION} seconds"
+    """ serve the last completed check results
+
+    a background thread per dataset reruns it when its result is older than its
+    refresh interval (default 60 seconds) and swaps in the new result when it
+    is done, so requests never wait for a check run (except the first one).
+    """
 
     def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshots: Dict[str, Snapshot] = {}
+
+        # one recompute at a time per dataset, concurrent callers share it
+        self._flights = {name: SingleFlight() for name in DATASETS}
+
+        # the data shared by all the datasets, replaced when a source expires
+        self._data = None
+        self._data_lock = threading.Lock()
+
         self.reset()
 
+        self._schedulers = []
+        for name in DATASETS:
+            t = threading.Thread(target=self._schedule, args=(name,), name=f"refresh-{name}", daemon=True)
+            t.start()
+            self._schedulers.append(t)
+
     @Pyro4.expose
     @property
     def load_date(self) -> datetime:
@@ -46,9 +156,8 @@ class CheckServer:
 
     @Pyro4.expose
     def reset(self):
-        self._working = None
-        self._current = None
-        self._history = None
+        from app.data.remote_cache import init_cache
+        from app.modeling.forecast_cache import init_forecast_cache
 
         logger.info("reset")
 
@@ -58,119 +167,177 @@ class CheckServer:
             enable_experimental=config["CHECKS"]["enable_experimental"] == "True",
             enable_debug=config["CHECKS"]["enable_debug"] == "True",
             save_results=config["CHECKS"]["save_results"] == "True",
+            keep_runs=int(config["CHECKS"]["keep_runs"]),
             images_dir=config["MODEL"]["images_dir"],
             plot_models=config["MODEL"]["plot_models"] == "True",
+            plot_mode=config["MODEL"]["plot_mode"],
+            plot_thumbnails=config["MODEL"]["plot_thumbnails"] == "True",
+            forecast_engine=config["MODEL"]["forecast_engine"],
+            upper_model=config["MODEL"]["upper_model"],
+            forecast_workers=int(config["MODEL"]["forecast_workers"]),
+            render_workers=int(config["MODEL"]["render_workers"]),
+            prefetch=config["CHECKS"]["prefetch"] == "True",
+            vectorized_checks=config["CHECKS"]["vectorized_checks"] == "True",
         )
+        init_cache(config["CACHE"]["cache_dir"])
+        init_forecast_cache(
+            int(config["CACHE"]["forecast_cache_size"]),
+            os.path.join(config["CACHE"]["cache_dir"], "forecasts"))
+
+        self.refresh_seconds = {
+            name: int(config["SERVICE"].get(f"{name}_refresh", CACHE_DIRECTION)) for name in DATASETS
+        }
+        self.ttls = {
+            name: int(config["SERVICE"][f"{name}_ttl"]) for name in ["working", "current", "history", "counties"]
+        }
+
+        with self._data_lock:
+            self._data = None
+        with self._lock:
+            self._snapshots = {}
+
+    def _data_source(self):
+        " the shared DataSource, with the expired sources reloaded "
+        from app.data.data_source import DataSource
+
+        with self._data_lock:
+            if self._data is None:
+                self._data = DataSource()
+            else:
+                self._data = self._data.refreshed(self.ttls)
+            return self._data
+
+    # --- snapshots
+    def _refresh(self, name: str) -> Snapshot:
+        """ rerun a dataset and swap in the new snapshot
+
+        if a rerun of the dataset is already going, wait for it and return its snapshot
+        """
+        def run() -> Snapshot:
+            logger.info(f"refresh {name}")
+            snapshot = run_check(name, self._data_source(), self.config)
+            with self._lock:
+                last = self._snapshots.get(name)
+                if snapshot.log is None and last is not None and last.log is not None:
+                    # a source is not available, keep serving the last result
+                    logger.error(f"could not run {name}, keep the result from {last.loaded_at}")
+                    last.failed_at = snapshot.loaded_at
+                    last.failure = snapshot.errors
+                    return last
+                self._snapshots[name] = snapshot
+            return snapshot
+
+        return self._flights[name].do(run)
+
+    def _snapshot(self, name: str) -> Snapshot:
+        " the last completed run, only waits if there hasn't been one yet "
+        with self._lock:
+            snapshot = self._snapshots.get(name)
+        if snapshot is None:
+            logger.info(f"first run of {name}")
+            snapshot = self._refresh(name)
+        return snapshot
+
+    def _schedule(self, name: str):
+        " rerun a dataset when its last run is older than its refresh interval "
+        while True:
+            with self._lock:
+                snapshot = self._snapshots.get(name)
+            if snapshot is None or \
+                    (udatetime.now_as_eastern() - snapshot.checked_at).total_seconds() > self.refresh_seconds[name]:
+                try:
+                    self._refresh(name)
+                except Exception as ex:
+                    logger.exception(ex)
+                    logger.error(f"refresh of {name} failed, keep the last result")
+                    time.sleep(self.refresh_seconds[name])
+            time.sleep(SCHEDULER_TICK)
 
-        self.ds = DataSource()
+    @Pyro4.expose
+    def fetch(self, name: str = None, formats: List[str] = None, gzipped: bool = False) -> Dict:
+        """ the service load date and the outputs of a dataset in one call
+
+        name=None only returns the load date, formats defaults to all of them,
+        gzipped returns the gzip of each output instead of the text.
+        """
+        result = {"load_date": load_date.isoformat()}
+        if name is None: return result
+        if name not in DATASETS: raise Exception(f"Unknown dataset {name}")
+
+        if formats is None: formats = FORMATS
+        for fmt in formats:
+            if fmt not in FORMATS: raise Exception(f"Unknown format {fmt}")
+
+        snapshot = self._snapshot(name)
+        outputs = snapshot.compressed if gzipped else snapshot.outputs
+        result["loaded_at"] = snapshot.loaded_at.isoformat()
+        result["version"] = snapshot.version
+        if snapshot.failed_at is not None:
+            result["failed_at"] = snapshot.failed_at.isoformat()
+        result["outputs"] = {fmt: outputs[fmt] for fmt in formats}
+        return result
 
     # --- working data
     @property
     def working(self) -> ResultLog:
-        if is_out_of_date(self._working, CACHE_DIRECTION):
-            logger.info("rerun because working dataset is out-of-date")
-            self.ds = DataSource()
-            self._working = check_working(self.ds, self.config)
-        return self._working
+        return self._snapshot("working").log
 
     @Pyro4.expose
     @property
     def working_csv(self) -> str:
-        w =  self.working
-        if w is None:
-            return self.ds.log.to_csv()
-        else:
-            return w.to_csv()
+        return self._snapshot("working").outputs["csv"]
 
     @Pyro4.expose
     @property
     def working_json(self) -> str:
-        w =  self.working
-        if w is None:
-            return self.ds.log.to_json()
-        else:
-            return w.to_json()
+        return self._snapshot("working").outputs["json"]
 
     @Pyro4.expose
     @property
     def working_html(self) -> str:
-        w =  self.working
-        if w is None:
-            return self.ds.log.to_html()
-        else:
-            return w.to_html()
+        return self._snapshot("working").outputs["html"]
 
 # -----------------------------------
 # --- current data
     @property
     def current(self) -> ResultLog:
-        if is_out_of_date(self._current, CACHE_DIRECTION):
-            self.ds = DataSource()
-            self._current = check_current(self.ds, self.config)
-        return self._current
+        return self._snapshot("current").log
 
     @Pyro4.expose
     @property
     def current_csv(self) -> str:
-        c =  self.current
-        if c is None:
-            return self.ds.log.to_csv()
-        else:
-            return c.to_csv()
+        return self._snapshot("current").outputs["csv"]
 
     @Pyro4.expose
     @property
     def current_json(self) -> str:
-        c =  self.current
-        if c is None:
-            return self.ds.log.to_json()
-        else:
-            return c.to_json()
+        return self._snapshot("current").outputs["json"]
 
     @Pyro4.expose
     @property
     def current_html(self) -> str:
-        c =  self.current
-        if c is None:
-            return self.ds.log.to_html()
-        else:
-            return c.to_html()
+        return self._snapshot("current").outputs["html"]
 
 # -----------------------------------
 # --- history data
     @property
     def history(self) -> ResultLog:
-        if is_out_of_date(self._history, CACHE_DIRECTION):
-            self.ds = DataSource()
-            self._history = check_history(self.ds)
-        return self._history
+        return self._snapshot("history").log
 
     @Pyro4.expose
     @property
     def history_csv(self) -> str:
-        h =  self.history
-        if h is None:
-            return self.ds.log.to_csv()
-        else:
-            return h.to_csv()
+        return self._snapshot("history").outputs["csv"]
 
     @Pyro4.expose
     @property
     def history_json(self) -> str:
-        h =  self.history
-        if h is None:
-            return self.ds.log.to_json()
-        else:
-            return h.to_json()
+        return self._snapshot("history").outputs["json"]
 
     @Pyro4.expose
     @property
     def history_html(self) -> str:
-        h =  self.history
-        if h is None:
-            return self.ds.log.to_html()
-        else:
-            return h.to_html()
+        return self._snapshot("history").outputs["html"]
 
 # -----------------------------------
 
@@ -208,6 +375,94 @@ def get_proxy() -> CheckServer:
 
     return server
 
+
+# proxies kept per flask worker process
+POOL_SIZE = 8
+RECONNECT_TRIES = 3
+
+def _is_dropped(proxy: Pyro4.Proxy) -> bool:
+    " check if an idle proxy needs to connect, an idle socket is only readable if the server closed it "
+    conn = proxy._pyroConnection
+    if conn is None: return True
+    try:
+        readable, _, _ = select.select([conn.sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    return len(readable) > 0
+
+
+class ProxyPool:
+    """ connected proxies to the CheckServer, shared by the threads of a worker
+
+    a Pyro4 proxy must not be used by two threads at the same time so each
+    call borrows one.  a proxy whose connection was dropped reconnects before the
+    call is sent.  the call itself is never retried, once it is sent the
+    server may have run it (a TimeoutError goes to the caller).
+    """
+
+    def __init__(self, size: int = POOL_SIZE):
+        self.size = size
+        self.pid = os.getpid()
+        self._idle: List[Pyro4.Proxy] = []
+        self._lock = threading.Lock()
+
+    def _acquire(self) -> Pyro4.Proxy:
+        with self._lock:
+            proxy = self._idle.pop() if len(self._idle) > 0 else None
+        # Pyro4 proxies are not tied to a thread, the checkout gives this thread the only use of it
+        return proxy if proxy is not None else get_proxy()
+
+    def _release(self, proxy: Pyro4.Proxy):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(proxy)
+                return
+        proxy._pyroRelease()
+
+    def call(self, fn: Callable[[CheckServer], Any]) -> Any:
+        " run fn (one remote call) with a pooled proxy "
+        proxy = self._acquire()
+        try:
+            if _is_dropped(proxy):
+                # nothing has been sent yet, safe to retry the connect
+                proxy._pyroReconnect(RECONNECT_TRIES)
+        except Pyro4.errors.CommunicationError:
+            proxy._pyroRelease()
+            raise
+
+        connected = False
+        try:
+            result = fn(proxy)
+            connected = True
+            return result
+        except Pyro4.errors.CommunicationError:
+            raise
+        except Exception:
+            # an error raised by the server, the connection is fine
+            connected = True
+            raise
+        finally:
+            if connected:
+                self._release(proxy)
+            else:
+                proxy._pyroRelease()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for proxy in idle:
+            proxy._pyroRelease()
+
+
+g_proxy_pool: ProxyPool = None
+
+def get_proxy_pool() -> ProxyPool:
+    " get the proxy pool of this process, a forked worker gets its own "
+    global g_proxy_pool
+    if g_proxy_pool is None or g_proxy_pool.pid != os.getpid():
+        g_proxy_pool = ProxyPool()
+    return g_proxy_pool
+
 if __name__ == '__main__':
     start_server()
 
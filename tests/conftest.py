@@ -0,0 +1,11 @@
+#
+# pytest setup -- run from the repo root:  python -m pytest -q tests
+#
+
+import os
+import sys
+
+# the entry points (run_quality_service, flaskcheck, ...) live in the repo root
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
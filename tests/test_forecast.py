@@ -0,0 +1,80 @@
+#
+# Forecast.fit and the forecast cache
+#
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import app.modeling.forecast_batch as forecast_batch
+from app.modeling.forecast import Forecast
+from app.modeling.forecast_cache import ForecastCache
+
+
+def make_history(states=("NY", "TX"), days: int = 30) -> pd.DataFrame:
+    " exponential growth, a different rate per state "
+    dates = [int(d.strftime("%Y%m%d")) for d in pd.date_range("2020-03-01", periods=days)]
+    rows = []
+    for i, state in enumerate(states):
+        for j, d in enumerate(dates):
+            rows.append({"state": state, "date": d, "positive": int(100 * np.exp((0.08 + 0.02 * i) * j))})
+    return pd.DataFrame(rows)
+
+
+def fit_state(history: pd.DataFrame, state: str, cache: ForecastCache, logistic: bool) -> Forecast:
+    forecast = Forecast()
+    forecast.date = int(history["date"].max()) + 1
+    forecast.fit(history.loc[history["state"] == state], cache, logistic)
+    return forecast
+
+
+@pytest.fixture
+def failing_logistic(monkeypatch):
+    " make every logistic fit fail, returns the call counter "
+    calls = []
+    def fit_logistic_batch(x, y, mask, exp_params):
+        calls.append(1)
+        return np.full((y.shape[0], 3), np.nan)
+    monkeypatch.setattr(forecast_batch, "fit_logistic_batch", fit_logistic_batch)
+    return calls
+
+
+def test_exp_only_fit_skips_the_logistic(failing_logistic):
+    forecast = fit_state(make_history(), "NY", ForecastCache(16), logistic=False)
+    assert len(failing_logistic) == 0
+    assert forecast.fitted_logistic_params is None
+    assert forecast.fitted_exp_params[1] == pytest.approx(0.08, rel=0.05)
+
+
+def test_failed_logistic_fit_is_cached(failing_logistic):
+    history, cache = make_history(), ForecastCache(16)
+
+    first = fit_state(history, "NY", cache, logistic=True)
+    second = fit_state(history, "NY", cache, logistic=True)
+
+    assert len(failing_logistic) == 1
+    assert first.fitted_logistic_params is None
+    assert second.fitted_logistic_params is None
+    assert cache.hits == 1
+
+
+def test_failed_logistic_fit_is_cached_by_the_batch_fit(failing_logistic):
+    history, cache = make_history(), ForecastCache(16)
+    target = int(history["date"].max()) + 1
+
+    forecast_batch.fit_forecasts(history, target, cache, logistic=True)
+    forecasts = forecast_batch.fit_forecasts(history, target, cache, logistic=True)
+
+    assert len(failing_logistic) == 1
+    assert all(f.fitted_logistic_params is None for f in forecasts.values())
+    assert cache.hits == 2
+
+
+def test_logistic_is_added_to_an_exp_only_entry():
+    history, cache = make_history(), ForecastCache(16)
+
+    fit_state(history, "NY", cache, logistic=False)
+    forecast = fit_state(history, "NY", cache, logistic=True)
+
+    assert forecast.fitted_logistic_params is not None
+    assert cache.get(next(iter(cache._entries)))[2] is not None
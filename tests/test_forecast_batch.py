@@ -0,0 +1,67 @@
+#
+# batch fits against the per-state curve_fit models
+#
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.modeling.forecast import _get_distribution_fit, _exp_fit, _linear_fit
+from app.modeling.forecast_batch import fit_exp_batch, fit_linear_batch
+
+
+def make_series(n_states: int = 5, n_days: int = 20):
+    " noisy exponential growth, states have different lengths (padded with masked cells) "
+    rng = np.random.RandomState(42)
+    x = np.tile(np.arange(n_days, dtype=float), (n_states, 1))
+    y = np.zeros((n_states, n_days))
+    mask = np.zeros((n_states, n_days), dtype=bool)
+    for i in range(n_states):
+        n = n_days - 2 * i
+        a, b = 50.0 * (i + 1), 0.05 + 0.03 * i
+        y[i, :n] = a * np.exp(b * x[i, :n]) * (1 + 0.05 * rng.randn(n))
+        mask[i, :n] = True
+    return x, y, mask
+
+
+def curve_fit_row(x, y, mask, i, func, p0):
+    p, _ = _get_distribution_fit(pd.Series(x[i][mask[i]]), pd.Series(y[i][mask[i]]), func, p0)
+    return p
+
+
+def sse(func, x, y, p) -> float:
+    return float(((y - func(x, *p)) ** 2).sum())
+
+
+def test_exp_matches_curve_fit():
+    x, y, mask = make_series()
+
+    batch = fit_exp_batch(x, y, mask)
+
+    for i in range(y.shape[0]):
+        expected = curve_fit_row(x, y, mask, i, _exp_fit, (y[i, 0], 0.1))
+        xi, yi = x[i][mask[i]], y[i][mask[i]]
+        assert batch[i] == pytest.approx(expected, rel=1e-3)
+        # never a worse fit than curve_fit
+        assert sse(_exp_fit, xi, yi, batch[i]) <= sse(_exp_fit, xi, yi, expected) * (1 + 1e-6)
+
+
+def test_linear_matches_curve_fit():
+    x, y, mask = make_series()
+    mask[:, 4:] = False
+
+    batch = fit_linear_batch(x, y, mask)
+
+    for i in range(y.shape[0]):
+        expected = curve_fit_row(x, y, mask, i, _linear_fit, (1, 0))
+        assert batch[i] == pytest.approx(expected, rel=1e-6, abs=1e-6)
+
+
+def test_empty_row_is_not_finite():
+    x, y, mask = make_series(n_states=2)
+    mask[1] = False
+
+    batch = fit_exp_batch(x, y, mask)
+
+    assert np.all(np.isfinite(batch[0]))
+    assert not np.all(np.isfinite(batch[1]))
@@ -0,0 +1,97 @@
+#
+# ForecastStore save/get/prune in a temporary results_dir
+#
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("tables")
+
+from app.modeling.forecast import Forecast
+from app.modeling.forecast_store import ForecastStore
+
+
+def make_forecast(state: str = "AZ", date: int = 20200101, expected_exp: int = 1002) -> Forecast:
+    forecast = Forecast()
+    forecast.state = state
+    forecast.date = date
+    forecast.actual_value = 1000
+    forecast.expected_exp = expected_exp
+    forecast.expected_linear = 999
+    forecast.expected_logistic = 0
+
+    forecast.df = pd.DataFrame({"state": pd.Categorical([state] * 4), "positive": [0, 1, 2, 4]})
+    forecast.cases_df = pd.DataFrame({"index": [0, 1, 2, 3], "positive": [0, 1, 2, 4]})
+    forecast.projection_index = 4
+    forecast.fitted_linear_params = np.array([0.0, 1.0])
+    forecast.fitted_exp_params = np.array([0.0, 1.0])
+    return forecast
+
+
+def save_run(results_dir: str, ts: str, forecasts, keep_runs: int = 24) -> ForecastStore:
+    " save a run with a fixed timestamp (the name has a one second resolution) "
+    store = ForecastStore(results_dir, "test", keep_runs)
+    store.path = os.path.join(results_dir, f"forecasts_test_{ts}.h5")
+    for f in forecasts:
+        store.add(f)
+    store.save()
+    return store
+
+
+def test_get_from_memory(tmp_path):
+    store = ForecastStore(str(tmp_path), "test")
+    forecast = make_forecast()
+    store.add(forecast)
+
+    assert store.get("AZ", 20200101) is forecast
+    assert store.get("AZ", 20200102) is None
+    assert store.all() == [forecast]
+
+
+def test_get_from_saved_runs(tmp_path):
+    save_run(str(tmp_path), "20200101_000000", [make_forecast(expected_exp=1)])
+    save_run(str(tmp_path), "20200102_000000", [make_forecast(expected_exp=2)])
+
+    store = ForecastStore(str(tmp_path), "other")
+    f = store.get("AZ", 20200101)
+    assert f is not None
+    # newest run first
+    assert f.expected_exp == 2
+    assert list(f.fitted_exp_params) == [0.0, 1.0]
+    assert list(f.cases_df["positive"]) == [0, 1, 2, 4]
+
+    assert store.get("TX", 20200101) is None
+
+
+def test_find_last(tmp_path):
+    save_run(str(tmp_path), "20200101_000000",
+        [make_forecast(date=20200101, expected_exp=1), make_forecast(date=20200103, expected_exp=3)])
+
+    store = ForecastStore(str(tmp_path), "other")
+    assert store.find_last("AZ", 20200105).expected_exp == 3
+    assert store.find_last("AZ", 20200102).expected_exp == 1
+    assert store.find_last("AZ", 20200101) is None
+
+
+def test_prune_keeps_the_newest_runs(tmp_path):
+    for day in range(1, 5):
+        save_run(str(tmp_path), f"2020010{day}_000000", [make_forecast()], keep_runs=2)
+
+    names = sorted(os.listdir(str(tmp_path)))
+    assert names == ["forecasts_test_20200103_000000.h5", "forecasts_test_20200104_000000.h5"]
+
+
+def test_prune_ignores_runs_pruned_by_another_run(tmp_path, monkeypatch):
+    for day in range(1, 4):
+        save_run(str(tmp_path), f"2020010{day}_000000", [make_forecast()])
+
+    store = ForecastStore(str(tmp_path), "other", keep_runs=1)
+    runs = store.saved_runs()
+    # another run removes the oldest file after this one listed it
+    os.remove(runs[-1])
+    monkeypatch.setattr(store, "saved_runs", lambda: runs)
+
+    store.prune()
+    assert os.listdir(str(tmp_path)) == ["forecasts_test_20200103_000000.h5"]
@@ -0,0 +1,26 @@
+#
+# Import budget -- the entry points load fast and leave the heavy modules lazy
+#
+
+import os
+import subprocess
+import pytest
+
+pytest.importorskip("loguru")
+
+from app.util.import_budget import BUDGETS, LAZY_MODULES, measure
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+@pytest.mark.parametrize("module", sorted(BUDGETS))
+def test_entry_point_leaves_heavy_modules_unloaded(module):
+    try:
+        x = measure(module, ROOT_DIR)
+    except subprocess.CalledProcessError as ex:
+        pytest.fail(f"import {module} failed\n{ex.stderr.decode('utf-8')}")
+
+    loaded = [m for m in LAZY_MODULES if m in x["modules"]]
+    assert loaded == [], f"{module} imports {', '.join(loaded)} at load"
+    assert x["elapsed"] <= BUDGETS[module], \
+        f"import {module} took {x['elapsed']:.2f}s, budget is {BUDGETS[module]:.2f}s"
@@ -0,0 +1,71 @@
+#
+# build_last_change_table against a per-state scan of the history
+#
+
+import numpy as np
+import pandas as pd
+
+from app.data.data_source import build_last_change_table
+
+
+def make_history() -> pd.DataFrame:
+    dates = [20200401 + i for i in range(10)]
+    rows = []
+    for d in dates:
+        # NY changes every day, TX stops changing after 20200405, CA never changes
+        rows.append({"state": "NY", "date": d, "positive": 100 * (d - 20200400), "death": 10})
+        rows.append({"state": "TX", "date": d, "positive": min(d, 20200405) - 20200400, "death": 0})
+        rows.append({"state": "CA", "date": d, "positive": 7, "death": 1})
+    # WA only has the last few days
+    for d in dates[-3:]:
+        rows.append({"state": "WA", "date": d, "positive": d - 20200400, "death": 2})
+    return pd.DataFrame(rows).sample(frac=1.0, random_state=1)
+
+
+def expected_row(df: pd.DataFrame, target_date: int, state: str, metric: str) -> dict:
+    " scan the history newest first, the way increasing_values used to "
+    df = df[(df.state == state) & (df.date < target_date)].sort_values("date", ascending=False)
+    prev_value, prev_date = df[metric].iloc[0], df["date"].iloc[0]
+    changed_value, changed_date = 0, 0
+    for value, date in zip(df[metric], df["date"]):
+        if value != prev_value:
+            changed_value, changed_date = value, date
+            break
+    return {
+        "prev_value": prev_value, "prev_date": prev_date,
+        "first_date": df["date"].iloc[-1],
+        "changed_value": changed_value, "changed_date": changed_date,
+    }
+
+
+def test_matches_scan():
+    history = make_history()
+    target_date = 20200409
+
+    table = build_last_change_table(history, target_date)
+
+    assert set(table.index) == {(s, m) for s in ["NY", "TX", "CA", "WA"] for m in ["positive", "death"]}
+    for (state, metric), row in table.iterrows():
+        assert row.to_dict() == expected_row(history, target_date, state, metric), (state, metric)
+
+
+def test_excludes_target_date():
+    history = make_history()
+
+    table = build_last_change_table(history, 20200405)
+
+    assert table.loc[("NY", "positive"), "prev_date"] == 20200404
+    assert table.loc[("NY", "positive"), "changed_date"] == 20200403
+    assert table.loc[("TX", "positive"), "changed_value"] == 3
+    assert table.loc[("CA", "positive"), "changed_date"] == 0
+    assert table.loc[("CA", "positive"), "first_date"] == 20200401
+    assert ("WA", "positive") not in table.index
+
+
+def test_missing_metrics_are_skipped():
+    history = make_history().drop(columns=["death"])
+
+    table = build_last_change_table(history, 20200420)
+
+    assert set(table.index.get_level_values("metric")) == {"positive"}
+    assert np.all(table["prev_date"] == 20200410)
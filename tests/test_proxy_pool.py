@@ -0,0 +1,83 @@
+#
+# ProxyPool against a real Pyro4 daemon
+#
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+pytest.importorskip("pandas")
+pytest.importorskip("loguru")
+Pyro4 = pytest.importorskip("Pyro4")
+
+import run_quality_service as service
+
+
+@Pyro4.expose
+class FakeServer:
+    " stands in for CheckServer.fetch "
+
+    def __init__(self):
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def fetch(self, name: str = None, formats=None, gzipped: bool = False):
+        with self._lock:
+            self.calls += 1
+        if name == "bad":
+            raise ValueError("Unknown dataset bad")
+        return {"load_date": "2020-10-17T00:00:00", "name": name}
+
+
+@pytest.fixture
+def server(monkeypatch):
+    daemon = Pyro4.Daemon(host=service.HOST, port=0)
+    daemon._pyroHmacKey = service.KEY
+    fake = FakeServer()
+    daemon.register(fake, objectId="checkServer")
+    monkeypatch.setattr(service, "PORT", int(daemon.locationStr.rsplit(":", 1)[1]))
+
+    t = threading.Thread(target=daemon.requestLoop, daemon=True)
+    t.start()
+    yield fake
+    daemon.shutdown()
+    t.join(5)
+
+
+def test_repeated_calls_reuse_a_proxy(server):
+    pool = service.ProxyPool(size=2)
+    try:
+        for _ in range(6):
+            assert pool.call(lambda s: s.fetch("working"))["name"] == "working"
+        assert server.calls == 6
+        assert len(pool._idle) == 1
+    finally:
+        pool.close()
+
+
+def test_concurrent_calls(server):
+    pool = service.ProxyPool(size=4)
+
+    def work(i: int) -> bool:
+        name = f"d{i}"
+        return pool.call(lambda s: s.fetch(name))["name"] == name
+
+    try:
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(work, range(80)))
+        assert all(results)
+        assert server.calls == 80
+        assert 0 < len(pool._idle) <= pool.size
+    finally:
+        pool.close()
+
+
+def test_server_error_keeps_the_proxy(server):
+    pool = service.ProxyPool(size=2)
+    try:
+        with pytest.raises(ValueError):
+            pool.call(lambda s: s.fetch("bad"))
+        assert len(pool._idle) == 1
+        assert pool.call(lambda s: s.fetch("working"))["name"] == "working"
+    finally:
+        pool.close()
@@ -0,0 +1,102 @@
+#
+# RemoteCache conditional GET: a 304 reuses the cached body and parsed value
+#
+
+import io
+
+import pytest
+
+import app.data.remote_cache as remote_cache
+from app.data.remote_cache import RemoteCache
+
+URL = "https://example.com/data.csv"
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, body: bytes = b"", headers: dict = None):
+        self.status_code = status_code
+        self.content = body
+        self.headers = headers or {}
+
+    def iter_content(self, chunk_size: int):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class FakeSession:
+    " returns the body with an ETag, then 304 when the ETag is sent back "
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.requests = []
+
+    def get(self, url, headers=None, timeout=None, stream=False):
+        self.requests.append(dict(headers or {}))
+        if (headers or {}).get("If-None-Match") == '"v1"':
+            return FakeResponse(304)
+        return FakeResponse(200, self.body, {"ETag": '"v1"', "Last-Modified": "Wed, 01 Apr 2020 00:00:00 GMT"})
+
+
+@pytest.fixture
+def session(monkeypatch):
+    s = FakeSession(b"state,positive\nNY,100\n")
+    monkeypatch.setattr(remote_cache, "get_session", lambda: s)
+    return s
+
+
+@pytest.fixture(params=["memory", "disk"])
+def cache(request, tmp_path):
+    return RemoteCache(str(tmp_path / "cache") if request.param == "disk" else None)
+
+
+def test_not_modified_reuses_body(cache, session):
+    parses = []
+    def parse(f: io.BufferedIOBase) -> bytes:
+        parses.append(1)
+        return f.read()
+
+    first = cache.load(URL, parse, "raw")
+    second = cache.load(URL, parse, "raw")
+
+    assert first == second == session.body
+    assert second is first
+    assert len(parses) == 1
+    assert session.requests[0] == {}
+    assert session.requests[1] == {
+        "If-None-Match": '"v1"',
+        "If-Modified-Since": "Wed, 01 Apr 2020 00:00:00 GMT",
+    }
+
+
+def test_not_modified_keeps_meta(cache, session):
+    meta = cache.fetch(URL)
+    assert cache.fetch(URL) == meta
+    assert len(meta["sha1"]) == 40
+
+
+def test_parsed_value_survives_restart(tmp_path, session):
+    cache_dir = str(tmp_path / "cache")
+    parses = []
+    def parse(f):
+        parses.append(1)
+        return f.read()
+
+    RemoteCache(cache_dir).load(URL, parse, "raw")
+    assert RemoteCache(cache_dir).load(URL, parse, "raw") == session.body
+    assert len(parses) == 1
+
+
+def test_error_status_raises(cache, monkeypatch):
+    class ErrorSession:
+        def get(self, url, **kwargs):
+            return FakeResponse(500)
+    monkeypatch.setattr(remote_cache, "get_session", lambda: ErrorSession())
+
+    with pytest.raises(Exception, match="status=500"):
+        cache.fetch(URL)
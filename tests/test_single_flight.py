@@ -0,0 +1,68 @@
+#
+# SingleFlight shares one run between concurrent callers
+#
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import pytest
+
+from app.util.single_flight import SingleFlight
+
+
+def run_concurrent(flight: SingleFlight, fn, n_callers: int = 8):
+    " start n_callers on flight.do(fn) while fn is blocked, returns the futures and the release event "
+    started = threading.Event()
+    release = threading.Event()
+
+    def blocked():
+        started.set()
+        release.wait(5)
+        return fn()
+
+    pool = ThreadPoolExecutor(n_callers)
+    leader = pool.submit(flight.do, blocked)
+    assert started.wait(5)
+    followers = [pool.submit(flight.do, blocked) for _ in range(n_callers - 1)]
+    return pool, [leader] + followers, release
+
+
+def test_concurrent_callers_share_one_run():
+    flight = SingleFlight()
+    calls = []
+    def fn():
+        calls.append(1)
+        return object()
+
+    pool, futures, release = run_concurrent(flight, fn)
+    assert flight.in_flight
+    release.set()
+    results = [f.result(5) for f in futures]
+    pool.shutdown()
+
+    assert len(calls) == 1
+    assert all(r is results[0] for r in results)
+    assert not flight.in_flight
+
+
+def test_error_reaches_every_caller():
+    flight = SingleFlight()
+    def fn():
+        raise ValueError("boom")
+
+    pool, futures, release = run_concurrent(flight, fn)
+    release.set()
+    for f in futures:
+        with pytest.raises(ValueError, match="boom"):
+            f.result(5)
+    pool.shutdown()
+
+    assert not flight.in_flight
+
+
+def test_later_calls_run_again():
+    flight = SingleFlight()
+    calls = []
+
+    assert flight.do(lambda: calls.append(1) or len(calls)) == 1
+    assert flight.do(lambda: calls.append(1) or len(calls)) == 2
@@ -0,0 +1,112 @@
+#
+# vector_checks gives the same messages, in the same order, as the checks.py row routines
+#
+
+import pandas as pd
+import pytest
+
+import app.checks as checks
+import app.vector_checks as vector_checks
+from app.qc_config import QCConfig
+from app.log.result_log import ResultLog, ResultCategory
+
+
+def ts(s: str) -> pd.Timestamp:
+    return pd.Timestamp(s, tz="US/Eastern")
+
+
+def make_rows() -> pd.DataFrame:
+    " one row per case the row checks look at "
+    target = ts("2020-04-20 16:00")
+    rows = [
+        # fine
+        ("AK", 100, 900, 0, 1, 1000, "2020-04-20 12:00", "2020-04-20 13:00", "ab", "cd", ""),
+        # negative positive, pending blank
+        ("AL", -5, 900, -1000, 1, 895, "2020-04-20 12:00", "2020-04-20 13:00", "ab", "cd", ""),
+        # total formula broken, high positive and death rates
+        ("AR", 600, 400, 10, 80, 1200, "2020-04-20 12:00", "2020-04-20 13:00", "ab", "", ""),
+        # not updated in 3 days, checked before the update, no checker
+        ("AZ", 50, 5000, 2000, 1, 7050, "2020-04-17 12:00", "2020-04-17 10:00", " ", "", ""),
+        # checked long ago, high pending rate
+        ("CA", 10, 1000, 900, 0, 1910, "2020-04-20 06:00", "2020-04-20 06:00", "ab", "cd", ""),
+        # checked recently without initials, bad update message
+        ("CO", 30, 70, 0, 0, 100, "2020-04-20 12:00", "2020-04-20 13:00", "", "", "bad date"),
+        # blank check time
+        ("CT", 30, 70, 0, 0, 100, "2020-04-20 12:00", "2019-12-01 00:00", "ab", "cd", ""),
+    ]
+    df = pd.DataFrame(rows, columns=["state", "positive", "negative", "pending", "death", "total",
+        "lastUpdateEt", "lastCheckEt", "checker", "doubleChecker", "lastUpdateEt_msg"])
+    df["lastUpdateEt"] = df["lastUpdateEt"].map(ts)
+    df["lastCheckEt"] = df["lastCheckEt"].map(ts)
+    df["targetDateEt"] = target
+    return df
+
+
+def messages(log: ResultLog) -> list:
+    return [(x.category, x.location, x.message) for x in log.messages]
+
+
+def make_config(near_release: bool) -> QCConfig:
+    config = QCConfig()
+    config.is_near_release = near_release
+    return config
+
+
+@pytest.mark.parametrize("near_release", [True, False])
+def test_working_rows_match_row_checks(near_release):
+    df, config = make_rows(), make_config(near_release)
+
+    expected = ResultLog()
+    for row in df.itertuples():
+        checks.last_update(row, expected)
+        checks.last_checked(row, expected, config)
+        checks.checkers_initials(row, expected, config)
+        checks.positives_rate(row, expected)
+        checks.death_rate(row, expected)
+        checks.pendings_rate(row, expected)
+
+    out = vector_checks.check_working_rows(df, config)
+    actual = ResultLog()
+    for row in df.itertuples():
+        out.emit(row.Index, actual)
+
+    assert len(messages(expected)) > 0
+    assert messages(actual) == messages(expected)
+
+
+def test_current_rows_match_row_checks():
+    df, config = make_rows(), make_config(False)
+
+    expected = ResultLog()
+    for row in df.itertuples():
+        checks.total(row, expected)
+        checks.last_update(row, expected)
+        checks.positives_rate(row, expected)
+        checks.death_rate(row, expected)
+        checks.pendings_rate(row, expected)
+
+    out = vector_checks.check_current_rows(df, config)
+    actual = ResultLog()
+    for row in df.itertuples():
+        out.emit(row.Index, actual)
+
+    assert messages(actual) == messages(expected)
+
+
+def test_counties_rollup_uses_the_median_source():
+    df = pd.DataFrame({"state": ["NY", "TX", "WA"], "positive": [10_000, 5_000, 100], "death": [500, 10, 0]})
+    counties = pd.DataFrame({
+        "state": ["NY", "NY", "NY", "TX", "TX", "TX"],
+        "source": ["cds", "csbs", "nyt", "cds", "csbs", "nyt"],
+        "cases": [20_000, 10_100, 9_900, 9_000, 5_000, 5_100],
+        "deaths": [1_000, 300, 310, 10, 10, 10],
+    })
+
+    out = vector_checks.check_county_rows(df, QCConfig(), counties)
+    log = ResultLog()
+    for row in df.itertuples():
+        out.emit(row.Index, log)
+
+    # NY positive matches the median (csbs), NY death does not (median nyt = 310), TX matches
+    assert messages(log) == [(ResultCategory.DATA_QUALITY, "NY",
+        "death (500) does not match nyt county aggregate (310, allow 232 to 397)")]